@@ -1,10 +1,18 @@
+import argparse
+import calendar
+import contextlib
 import getpass
+import json
 import os
+import random
+import re
 import shutil
 import subprocess
 import sys
+import threading
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     from google.cloud import compute_v1
@@ -42,6 +50,448 @@ OS_IMAGE_OPTIONS = [
 ]
 
 
+# ------------------------------------------------
+# 耗时追踪 (API 调用 / 操作等待 / 固定等待 / 子进程)
+# ------------------------------------------------
+
+PAGED_METHODS = ("list", "aggregated_list", "search_projects")
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def enable(self):
+        self.enabled = True
+        self.started = time.time()
+
+    @contextlib.contextmanager
+    def span(self, name, category, **attrs):
+        if not self.enabled:
+            yield attrs
+            return
+        start = time.time()
+        outcome = "ok"
+        try:
+            yield attrs
+        except BaseException as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            if outcome == "ok" and attrs.get("outcome"):
+                outcome = attrs.pop("outcome")
+            with self.lock:
+                self.spans.append(
+                    {
+                        "name": name,
+                        "category": category,
+                        "start": start,
+                        "duration": time.time() - start,
+                        "outcome": outcome,
+                        "thread": threading.get_ident(),
+                        "attrs": attrs,
+                    }
+                )
+
+    def export_chrome(self, path):
+        events = []
+        for span in self.spans:
+            events.append(
+                {
+                    "name": span["name"],
+                    "cat": span["category"],
+                    "ph": "X",
+                    "ts": int((span["start"] - self.started) * 1e6),
+                    "dur": int(span["duration"] * 1e6),
+                    "pid": os.getpid(),
+                    "tid": span["thread"],
+                    "args": dict(span["attrs"], outcome=span["outcome"]),
+                }
+            )
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+    def aggregate(self):
+        totals = {}
+        for span in self.spans:
+            key = (span["category"], span["name"], span["outcome"])
+            count, seconds = totals.get(key, (0, 0.0))
+            totals[key] = (count + 1, seconds + span["duration"])
+        return totals
+
+    def prometheus_lines(self):
+        lines = [
+            "# HELP gcp_free_span_seconds_total Total time spent in traced spans.",
+            "# TYPE gcp_free_span_seconds_total counter",
+        ]
+        totals = self.aggregate()
+        for (category, name, outcome), (count, seconds) in sorted(totals.items()):
+            labels = f'category="{category}",name="{name}",outcome="{outcome}"'
+            lines.append(f"gcp_free_span_seconds_total{{{labels}}} {seconds:.6f}")
+        lines += [
+            "# HELP gcp_free_span_count_total Number of traced spans.",
+            "# TYPE gcp_free_span_count_total counter",
+        ]
+        for (category, name, outcome), (count, seconds) in sorted(totals.items()):
+            labels = f'category="{category}",name="{name}",outcome="{outcome}"'
+            lines.append(f"gcp_free_span_count_total{{{labels}}} {count}")
+        lines += [
+            "# HELP gcp_free_run_seconds Wall-clock duration of this run.",
+            "# TYPE gcp_free_run_seconds gauge",
+            f"gcp_free_run_seconds {time.time() - self.started:.6f}",
+        ]
+        return lines
+
+    def export_prometheus(self, path, extra_lines=()):
+        # 先写临时文件再改名，避免 node_exporter 读到写了一半的文件
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(self.prometheus_lines() + list(extra_lines)) + "\n")
+        os.replace(tmp_path, path)
+
+    def print_summary(self, stream=None, wall=None):
+        stream = stream or sys.stderr
+        if wall is None:
+            wall = time.time() - self.started
+        by_category = {}
+        by_name = {}
+        for (category, name, outcome), (count, seconds) in self.aggregate().items():
+            by_category[category] = by_category.get(category, 0.0) + seconds
+            c, s = by_name.get((category, name), (0, 0.0))
+            by_name[(category, name)] = (c + count, s + seconds)
+
+        stream.write("\n========== 耗时统计 ==========\n")
+        stream.write(f"总耗时: {wall:.2f}s (多线程时各分类之和可能超过总耗时)\n")
+        for category, seconds in sorted(by_category.items(), key=lambda kv: -kv[1]):
+            percent = seconds / wall * 100 if wall else 0
+            stream.write(f"  {category:<12} {seconds:>9.2f}s  {percent:5.1f}%\n")
+        untraced = wall - sum(by_category.values())
+        if untraced > 0:
+            stream.write(f"  {'other':<12} {untraced:>9.2f}s  {untraced / wall * 100:5.1f}%  (本地处理/等待输入)\n")
+        stream.write("------------------------------\n")
+        top = sorted(by_name.items(), key=lambda kv: -kv[1][1])[:10]
+        for (category, name), (count, seconds) in top:
+            stream.write(f"  {name:<40} x{count:<5} {seconds:>9.2f}s  [{category}]\n")
+        stream.flush()
+
+
+TRACER = Tracer()
+
+
+# ------------------------------------------------
+# API 调度 (按配额限速 / 失败重试)
+# ------------------------------------------------
+
+# 每秒请求数。默认值按 Compute Engine 每分钟速率配额 (读取 / 列表 / 操作查询 / 写入)
+# 折算后再打折，给控制台和其他工具留出余量；可用 --api-rate GROUP=QPS 覆盖，0 表示不限速
+API_RATE_LIMITS = {
+    "read": 20.0,
+    "list": 5.0,
+    "operations": 20.0,
+    "mutate": 10.0,
+    "resourcemanager": 5.0,
+}
+READ_METHODS = ("get", "get_from_family", "get_guest_attributes", "get_serial_port_output")
+# 重复执行结果不变的写操作（对已启动的实例再次 start 不会有副作用），遇到 5xx 也可以重试
+IDEMPOTENT_MUTATIONS = ("start", "stop")
+OPERATION_CLIENTS = ("ZoneOperationsClient", "GlobalOperationsClient")
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+def api_group(client_name, method_name):
+    if client_name == "ProjectsClient":
+        return "resourcemanager"
+    if client_name in OPERATION_CLIENTS:
+        return "operations"
+    if method_name in PAGED_METHODS:
+        return "list"
+    if method_name in READ_METHODS:
+        return "read"
+    return "mutate"
+
+
+def api_error_code(exc):
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return code
+    match = re.match(r"\s*(\d{3})\b", str(exc))
+    return int(match.group(1)) if match else None
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = None
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        # 令牌允许透支，返回需要等待的秒数；并发请求按预约先后依次放行，不会忙等
+        with self.lock:
+            now = time.monotonic()
+            if self.updated is None or now < self.updated:
+                self.updated = now
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class ApiScheduler:
+    def __init__(self, rates=None, max_retries=5, base_delay=1.0, max_delay=32.0):
+        self.lock = threading.Lock()
+        self.rates = {}
+        self.buckets = {}
+        self.stats = {}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.configure(rates or API_RATE_LIMITS)
+
+    def configure(self, rates=None, max_retries=None):
+        with self.lock:
+            if rates:
+                self.rates.update(rates)
+                self.buckets = {group: TokenBucket(rate) for group, rate in self.rates.items() if rate > 0}
+            if max_retries is not None:
+                self.max_retries = max_retries
+
+    def group_stats(self, group):
+        stats = self.stats.get(group)
+        if stats is None:
+            stats = {
+                "calls": 0,
+                "throttled": 0,
+                "throttled_seconds": 0.0,
+                "retries": {},
+                "gave_up": 0,
+                "queue_depth": 0,
+                "queue_depth_max": 0,
+            }
+            self.stats[group] = stats
+        return stats
+
+    def acquire(self, group):
+        bucket = self.buckets.get(group)
+        wait = bucket.reserve() if bucket else 0.0
+        with self.lock:
+            stats = self.group_stats(group)
+            stats["calls"] += 1
+            if wait <= 0:
+                return
+            stats["throttled"] += 1
+            stats["throttled_seconds"] += wait
+            stats["queue_depth"] += 1
+            stats["queue_depth_max"] = max(stats["queue_depth_max"], stats["queue_depth"])
+        try:
+            traced_sleep(wait, f"throttle.{group}")
+        finally:
+            with self.lock:
+                self.group_stats(group)["queue_depth"] -= 1
+
+    def call(self, group, idempotent, fn):
+        attempt = 0
+        while True:
+            self.acquire(group)
+            try:
+                return fn()
+            except Exception as e:
+                code = api_error_code(e)
+                # 429 表示请求被拒绝、尚未执行，任何请求都可以安全重试；其他 5xx 只重试幂等请求
+                retryable = code == 429 or (idempotent and code in RETRYABLE_STATUS_CODES)
+                if not retryable:
+                    raise
+                with self.lock:
+                    stats = self.group_stats(group)
+                    if attempt >= self.max_retries:
+                        stats["gave_up"] += 1
+                        raise
+                    stats["retries"][code] = stats["retries"].get(code, 0) + 1
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+                attempt += 1
+                traced_sleep(delay, f"retry.{group}")
+
+    def prometheus_lines(self):
+        with self.lock:
+            stats = {group: dict(values, retries=dict(values["retries"])) for group, values in self.stats.items()}
+            rates = dict(self.rates)
+        lines = [
+            "# HELP gcp_free_api_rate_limit Configured request rate per API group (requests per second, 0 = unlimited).",
+            "# TYPE gcp_free_api_rate_limit gauge",
+        ]
+        for group, rate in sorted(rates.items()):
+            lines.append(f'gcp_free_api_rate_limit{{group="{group}"}} {rate:g}')
+        metrics = [
+            ("calls", "gcp_free_api_calls_total", "counter", "API call attempts, including retries."),
+            ("throttled", "gcp_free_api_throttled_total", "counter", "Calls delayed by the rate limiter."),
+            ("throttled_seconds", "gcp_free_api_throttle_seconds_total", "counter", "Time spent waiting for rate limit tokens."),
+            ("gave_up", "gcp_free_api_gave_up_total", "counter", "Calls that still failed after all retries."),
+            ("queue_depth", "gcp_free_api_queue_depth", "gauge", "Calls currently waiting for rate limit tokens."),
+            ("queue_depth_max", "gcp_free_api_queue_depth_max", "gauge", "Peak number of calls waiting for rate limit tokens."),
+        ]
+        for key, name, kind, help_text in metrics:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for group, values in sorted(stats.items()):
+                value = values[key]
+                lines.append(f'{name}{{group="{group}"}} {value:.6f}' if isinstance(value, float) else f'{name}{{group="{group}"}} {value}')
+        lines += [
+            "# HELP gcp_free_api_retries_total Retried API calls by status code.",
+            "# TYPE gcp_free_api_retries_total counter",
+        ]
+        for group, values in sorted(stats.items()):
+            for code, count in sorted(values["retries"].items()):
+                lines.append(f'gcp_free_api_retries_total{{group="{group}",code="{code}"}} {count}')
+        return lines
+
+    def print_summary(self, stream=None):
+        stream = stream or sys.stderr
+        with self.lock:
+            stats = {group: dict(values, retries=dict(values["retries"])) for group, values in self.stats.items()}
+        if not stats:
+            return
+        stream.write("---------- API 调度 ----------\n")
+        for group, values in sorted(stats.items()):
+            retries = ", ".join(f"{code} x{count}" for code, count in sorted(values["retries"].items())) or "-"
+            stream.write(
+                f"  {group:<16} 调用 {values['calls']:<6} 重试 {retries:<20} "
+                f"限速 {values['throttled']} 次 / {values['throttled_seconds']:.2f}s  最大排队 {values['queue_depth_max']}\n"
+            )
+        stream.flush()
+
+
+SCHEDULER = ApiScheduler()
+
+
+class TracedClient:
+    def __init__(self, client, client_name):
+        self._client = client
+        self._client_name = client_name
+
+    def __getattr__(self, method_name):
+        method = getattr(self._client, method_name)
+        if not callable(method):
+            return method
+        category = "wait" if method_name == "wait" else "api"
+        span_name = f"{self._client_name}.{method_name}"
+        group = api_group(self._client_name, method_name)
+        idempotent = group != "mutate" or method_name in IDEMPOTENT_MUTATIONS
+
+        def attempt(*args, **kwargs):
+            with TRACER.span(span_name, category):
+                result = method(*args, **kwargs)
+                # 分页结果在迭代时才真正发请求，这里一次取完，让耗时落在 span 内
+                if method_name in PAGED_METHODS:
+                    result = list(result)
+                return result
+
+        def call(*args, **kwargs):
+            return SCHEDULER.call(group, idempotent, lambda: attempt(*args, **kwargs))
+
+        return call
+
+
+def compute_client(client_name):
+    return TracedClient(getattr(compute_v1, client_name)(), client_name)
+
+
+def resourcemanager_client(client_name):
+    return TracedClient(getattr(resourcemanager_v3, client_name)(), client_name)
+
+
+def traced_sleep(seconds, reason="sleep"):
+    with TRACER.span(reason, "sleep"):
+        time.sleep(seconds)
+
+
+def finish_tracing(args):
+    if not TRACER.enabled:
+        return
+    if args.trace_chrome:
+        TRACER.export_chrome(args.trace_chrome)
+    if args.trace_prom:
+        TRACER.export_prometheus(args.trace_prom, SCHEDULER.prometheus_lines())
+    if args.trace_summary:
+        TRACER.print_summary()
+        SCHEDULER.print_summary()
+
+
+# ------------------------------------------------
+# 后台预取 (交互菜单)
+# ------------------------------------------------
+
+
+class Prefetcher:
+    def __init__(self):
+        self.executor = None
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def start(self, max_workers=4):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        with self.lock:
+            self.entries.clear()
+
+    def submit(self, key, fn, *args):
+        if self.executor is None:
+            return
+        with self.lock:
+            self.entries[key] = (self.executor.submit(fn, *args), fn, args)
+
+    def get(self, key, fn, *args):
+        # 已预取则直接取结果（仍在进行中就等它完成），没有或预取失败时同步调用，
+        # 让异常照常交给调用方处理
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None:
+            try:
+                return entry[0].result()
+            except Exception:
+                pass
+        return fn(*args)
+
+    def refresh(self, *keys):
+        for key in keys:
+            with self.lock:
+                entry = self.entries.get(key)
+            if entry is not None:
+                self.submit(key, entry[1], *entry[2])
+
+
+PREFETCHER = Prefetcher()
+
+
+def prefetch_menu_data(project_id):
+    PREFETCHER.submit(("instances", project_id), list_instances, project_id, True)
+    PREFETCHER.submit(("zones", project_id), list_zones_by_region, project_id)
+    PREFETCHER.submit(("baked_images", project_id), prefetch_baked_images, project_id)
+    for os_config in OS_IMAGE_OPTIONS:
+        prefetch_image(os_config)
+
+
+def prefetch_image(os_config):
+    key = ("image", os_config["project"], os_config["family"])
+    PREFETCHER.submit(key, get_image_from_family, os_config["project"], os_config["family"])
+
+
+def prefetch_baked_images(project_id):
+    options = list_baked_image_options(project_id)
+    for os_config in options:
+        prefetch_image(os_config)
+    return options
+
+
 def print_info(msg):
     print(f"[信息] {msg}")
     sys.stdout.flush()
@@ -81,7 +531,7 @@ def prompt_manual_project_id():
 def select_gcp_project():
     print_info("正在扫描您的项目列表...")
     try:
-        client = resourcemanager_v3.ProjectsClient()
+        client = resourcemanager_client("ProjectsClient")
         request = resourcemanager_v3.SearchProjectsRequest(query="")
         page_result = client.search_projects(request=request)
 
@@ -112,16 +562,15 @@ def select_gcp_project():
         return prompt_manual_project_id()
 
 
-def list_zones_for_region(project_id, region):
-    zones_client = compute_v1.ZonesClient()
-    zones = []
+def list_zones_by_region(project_id):
+    zones_client = compute_client("ZonesClient")
+    zones = {}
     for zone in zones_client.list(project=project_id):
         if zone.status != "UP":
             continue
         zone_region = zone.region.split("/")[-1] if zone.region else ""
-        if zone_region == region:
-            zones.append(zone.name)
-    return sorted(zones)
+        zones.setdefault(zone_region, []).append(zone.name)
+    return {region: sorted(names) for region, names in zones.items()}
 
 
 def select_zone(project_id):
@@ -131,7 +580,7 @@ def select_zone(project_id):
 
     print_info(f"正在获取 {region} 的可用区列表...")
     try:
-        zones = list_zones_for_region(project_id, region)
+        zones = PREFETCHER.get(("zones", project_id), list_zones_by_region, project_id).get(region, [])
     except Exception as e:
         print_warning(f"获取可用区失败: {e}。将使用默认可用区 {default_zone}。")
         return default_zone
@@ -143,22 +592,33 @@ def select_zone(project_id):
     return select_from_list(zones, f"请选择可用区 ({region})", lambda z: z)
 
 
-def select_os_image():
-    return select_from_list(OS_IMAGE_OPTIONS, "请选择操作系统", lambda o: o["name"])
+def select_os_image(project_id):
+    options = list(OS_IMAGE_OPTIONS)
+    try:
+        options += PREFETCHER.get(("baked_images", project_id), list_baked_image_options, project_id)
+    except Exception as e:
+        print_warning(f"获取自制镜像失败: {e}")
+    return select_from_list(options, "请选择操作系统", lambda o: o["name"])
+
+
+def get_image_from_family(image_project, family):
+    images_client = compute_client("ImagesClient")
+    return images_client.get_from_family(project=image_project, family=family)
 
 
-def create_instance(project_id, zone, os_config, instance_name="free-tier-vm"):
-    instance_client = compute_v1.InstancesClient()
-    images_client = compute_v1.ImagesClient()
+def create_instance(project_id, zone, os_config, instance_name="free-tier-vm", provision_steps=None):
+    instance_client = compute_client("InstancesClient")
 
     print(f"\n[开始] 正在 {project_id} 项目中准备资源...")
     print(f"可用区: {zone}")
     print(f"系统: {os_config['name']}")
 
     try:
-        image_response = images_client.get_from_family(
-            project=os_config["project"],
-            family=os_config["family"],
+        image_response = PREFETCHER.get(
+            ("image", os_config["project"], os_config["family"]),
+            get_image_from_family,
+            os_config["project"],
+            os_config["family"],
         )
         source_disk_image = image_response.self_link
 
@@ -190,6 +650,18 @@ def create_instance(project_id, zone, os_config, instance_name="free-tier-vm"):
         tags.items = ["http-server", "https-server"]
         instance.tags = tags
 
+        if provision_steps and "apt" in provision_steps and os_config["project"] != "debian-cloud" and not os_config.get("baked"):
+            print_warning("换源脚本仅适配 Debian，已跳过 apt 步骤。")
+            provision_steps = [step for step in provision_steps if step != "apt"]
+        if provision_steps or os_config.get("baked"):
+            # 自制镜像即使不追加步骤也附带 startup-script，用于重置镜像里残留的流量统计
+            metadata_items = build_provision_metadata(provision_steps or [], baked=bool(os_config.get("baked")))
+            instance.metadata = compute_v1.Metadata(
+                items=[compute_v1.Items(key=key, value=value) for key, value in metadata_items.items()]
+            )
+            if provision_steps:
+                print(f"已附加开机配置: {', '.join(step for step in PROVISION_STEPS if step in provision_steps)}")
+
         print("配置组装完成，正在向 Google Cloud 发送创建请求...")
         operation = instance_client.insert(
             project=project_id,
@@ -198,7 +670,7 @@ def create_instance(project_id, zone, os_config, instance_name="free-tier-vm"):
         )
 
         print("请求已发送，正在等待操作完成... (约 30-60 秒)")
-        operation_client = compute_v1.ZoneOperationsClient()
+        operation_client = compute_client("ZoneOperationsClient")
         operation = operation_client.wait(
             project=project_id,
             zone=zone,
@@ -207,26 +679,31 @@ def create_instance(project_id, zone, os_config, instance_name="free-tier-vm"):
 
         if operation.error:
             print("创建失败:", operation.error)
-        else:
-            print_success(f"实例 '{instance_name}' 已创建！")
-            try:
-                inst_info = instance_client.get(project=project_id, zone=zone, instance=instance_name)
-                ip = inst_info.network_interfaces[0].access_configs[0].nat_i_p
-                print(f"外部 IP 地址: {ip}")
-            except Exception:
-                pass
-            print("请前往 GCP 控制台查看详情。")
+            return None
+
+        print_success(f"实例 '{instance_name}' 已创建！")
+        created = {"name": instance_name, "zone": zone}
+        try:
+            inst_info = instance_client.get(project=project_id, zone=zone, instance=instance_name)
+            created = instance_to_dict(inst_info, zone)
+            print(f"外部 IP 地址: {created['external_ip']}")
+        except Exception:
+            pass
+        print("请前往 GCP 控制台查看详情。")
+        return created
 
     except Exception as e:
         print(f"\n[失败] 操作中止: {e}")
         traceback.print_exc()
+        return None
 
 
-def list_instances(project_id):
-    instance_client = compute_v1.InstancesClient()
+def list_instances(project_id, quiet=False):
+    instance_client = compute_client("InstancesClient")
     request = compute_v1.AggregatedListInstancesRequest(project=project_id)
 
-    print_info(f"正在扫描项目 {project_id} 中的实例...")
+    if not quiet:
+        print_info(f"正在扫描项目 {project_id} 中的实例...")
 
     instances = []
     for zone_path, response in instance_client.aggregated_list(request=request):
@@ -234,31 +711,49 @@ def list_instances(project_id):
             continue
         zone_short = zone_path.split("/")[-1]
         for instance in response.instances:
-            network = None
-            internal_ip = "-"
-            external_ip = "-"
-            if instance.network_interfaces:
-                network = instance.network_interfaces[0].network
-                internal_ip = instance.network_interfaces[0].network_i_p
-                access_configs = instance.network_interfaces[0].access_configs
-                if access_configs:
-                    external_ip = access_configs[0].nat_i_p or "-"
-            instances.append(
-                {
-                    "name": instance.name,
-                    "zone": zone_short,
-                    "status": instance.status,
-                    "cpu_platform": instance.cpu_platform or "Unknown CPU Platform",
-                    "network": network or "global/networks/default",
-                    "internal_ip": internal_ip,
-                    "external_ip": external_ip,
-                }
-            )
+            instances.append(instance_to_dict(instance, zone_short))
     return instances
 
 
+def instance_to_dict(instance, zone):
+    network = None
+    internal_ip = "-"
+    external_ip = "-"
+    if instance.network_interfaces:
+        network = instance.network_interfaces[0].network
+        internal_ip = instance.network_interfaces[0].network_i_p
+        access_configs = instance.network_interfaces[0].access_configs
+        if access_configs:
+            external_ip = access_configs[0].nat_i_p or "-"
+    return {
+        "name": instance.name,
+        "zone": zone,
+        "status": instance.status,
+        "cpu_platform": instance.cpu_platform or "Unknown CPU Platform",
+        "network": network or "global/networks/default",
+        "internal_ip": internal_ip,
+        "external_ip": external_ip,
+    }
+
+
+def find_instance(project_id, instance_name, zone=None):
+    if zone:
+        instance_client = compute_client("InstancesClient")
+        try:
+            inst = instance_client.get(project=project_id, zone=zone, instance=instance_name)
+        except Exception as e:
+            if is_not_found_error(e):
+                return None
+            raise
+        return instance_to_dict(inst, zone)
+    for inst in list_instances(project_id):
+        if inst["name"] == instance_name:
+            return inst
+    return None
+
+
 def select_instance(project_id):
-    instances = list_instances(project_id)
+    instances = PREFETCHER.get(("instances", project_id), list_instances, project_id)
     if not instances:
         print_warning("该项目中没有任何实例！")
         return None
@@ -283,19 +778,19 @@ def select_instance(project_id):
 
 
 def wait_for_operation(project_id, zone, operation_name):
-    operation_client = compute_v1.ZoneOperationsClient()
+    operation_client = compute_client("ZoneOperationsClient")
     return operation_client.wait(project=project_id, zone=zone, operation=operation_name)
 
 
-def reroll_cpu_loop(project_id, instance_info):
+def reroll_cpu_loop(project_id, instance_info, cpu_keyword="AMD", max_attempts=None):
     instance_name = instance_info["name"]
     zone = instance_info["zone"]
 
-    instance_client = compute_v1.InstancesClient()
+    instance_client = compute_client("InstancesClient")
     attempt_counter = 1
 
     print_info(f"目标实例: {instance_name} ({zone})")
-    print_info("目标: 只要 CPU 包含 'AMD' 即停止。")
+    print_info(f"目标: 只要 CPU 包含 '{cpu_keyword}' 即停止。")
 
     while True:
         print("\n" + "=" * 50)
@@ -325,24 +820,28 @@ def reroll_cpu_loop(project_id, instance_info):
 
             if (i + 1) % 5 == 0:
                 print_info(f"正在等待 CPU 元数据同步... ({i+1}/{max_retries}) - 机器正在启动中")
-            time.sleep(2)
+            traced_sleep(2, "reroll.poll_cpu_platform")
 
         if current_platform == "Unknown CPU Platform":
             print_warning("超时：等待 2 分钟后仍无法获取 CPU 信息。")
         else:
             print_info(f"检测到 CPU: {current_platform}")
 
-        if "AMD" in str(current_platform).upper():
+        if cpu_keyword.upper() in str(current_platform).upper():
             print_success(f"恭喜！已成功刷到目标 CPU: {current_platform}")
             print_info("脚本执行完毕。")
-            break
+            return {"matched": True, "cpu_platform": current_platform, "attempts": attempt_counter}
+
+        if max_attempts and attempt_counter >= max_attempts:
+            print_warning(f"已达到最大尝试次数 ({max_attempts})，停止刷 CPU。当前 CPU: {current_platform}")
+            return {"matched": False, "cpu_platform": current_platform, "attempts": attempt_counter}
 
         print_warning(f"结果不满意 ({current_platform})。准备重置...")
         print_info(f"正在关停虚拟机 {instance_name}...")
         op = instance_client.stop(project=project_id, zone=zone, instance=instance_name)
         wait_for_operation(project_id, zone, op.name)
         attempt_counter += 1
-        time.sleep(2)
+        traced_sleep(2, "reroll.cooldown")
 
 
 def read_cdn_ips(filename="cdnip.txt"):
@@ -376,7 +875,7 @@ def set_protocol_field(config_object, value):
 
 
 def add_allow_all_ingress(project_id, network):
-    firewall_client = compute_v1.FirewallsClient()
+    firewall_client = compute_client("FirewallsClient")
     rule_name = "allow-all-ingress-custom"
 
     print(f"\n正在创建入站规则: {rule_name} ...")
@@ -395,23 +894,25 @@ def add_allow_all_ingress(project_id, network):
     try:
         operation = firewall_client.insert(project=project_id, firewall_resource=firewall_rule)
         print("正在应用规则...")
-        operation_client = compute_v1.GlobalOperationsClient()
+        operation_client = compute_client("GlobalOperationsClient")
         operation_client.wait(project=project_id, operation=operation.name)
         print_success("已添加允许所有入站连接的规则。")
+        return True
     except Exception as e:
         if "already exists" in str(e):
             print_warning(f"规则 {rule_name} 已存在。")
-        else:
-            print(f"【失败】{e}")
-            traceback.print_exc()
+            return True
+        print(f"【失败】{e}")
+        traceback.print_exc()
+        return False
 
 
 def add_deny_cdn_egress(project_id, ip_ranges, network):
     if not ip_ranges:
         print("IP 列表为空，跳过创建拒绝规则。")
-        return
+        return False
 
-    firewall_client = compute_v1.FirewallsClient()
+    firewall_client = compute_client("FirewallsClient")
     rule_name = "deny-cdn-egress-custom"
 
     print(f"\n正在创建出站拒绝规则: {rule_name} ...")
@@ -430,15 +931,26 @@ def add_deny_cdn_egress(project_id, ip_ranges, network):
     try:
         operation = firewall_client.insert(project=project_id, firewall_resource=firewall_rule)
         print("正在应用规则...")
-        operation_client = compute_v1.GlobalOperationsClient()
+        operation_client = compute_client("GlobalOperationsClient")
         operation_client.wait(project=project_id, operation=operation.name)
         print_success(f"已添加拒绝规则，共拦截 {len(ip_ranges)} 个 IP 段。")
+        return True
     except Exception as e:
         if "already exists" in str(e):
             print_warning(f"规则 {rule_name} 已存在。")
-        else:
-            print(f"【失败】{e}")
-            traceback.print_exc()
+            return True
+        print(f"【失败】{e}")
+        traceback.print_exc()
+        return False
+
+
+def read_cdn_ips_for_rule(filename="cdnip.txt"):
+    ips = read_cdn_ips(filename)
+    if len(ips) > 256:
+        print(f"【警告】IP 数量 ({len(ips)}) 超过 GCP 单条规则上限 (256)。")
+        print("脚本将只取前 256 个 IP。")
+        ips = ips[:256]
+    return ips
 
 
 def configure_firewall(project_id, network):
@@ -455,13 +967,8 @@ def configure_firewall(project_id, network):
 
     choice_out = input("\n[2/2] 是否添加【拒绝对 cdnip.txt 中 IP 的出站连接】规则? (y/n): ").strip().lower()
     if choice_out == "y":
-        ips = read_cdn_ips()
+        ips = read_cdn_ips_for_rule()
         if ips:
-            if len(ips) > 256:
-                print(f"【警告】IP 数量 ({len(ips)}) 超过 GCP 单条规则上限 (256)。")
-                print("脚本将只取前 256 个 IP。")
-                ips = ips[:256]
-
             add_deny_cdn_egress(project_id, ips, network)
     else:
         print("已跳过出站规则配置。")
@@ -475,10 +982,10 @@ def is_not_found_error(exc):
 
 
 def delete_firewall_rule(project_id, rule_name):
-    firewall_client = compute_v1.FirewallsClient()
+    firewall_client = compute_client("FirewallsClient")
     try:
         operation = firewall_client.delete(project=project_id, firewall=rule_name)
-        operation_client = compute_v1.GlobalOperationsClient()
+        operation_client = compute_client("GlobalOperationsClient")
         operation_client.wait(project=project_id, operation=operation.name)
         print_success(f"已删除防火墙规则: {rule_name}")
         return True
@@ -493,7 +1000,7 @@ def delete_firewall_rule(project_id, rule_name):
 def delete_disks_if_needed(project_id, zone, disk_names):
     if not disk_names:
         return True
-    disk_client = compute_v1.DisksClient()
+    disk_client = compute_client("DisksClient")
     all_ok = True
     for disk_name in disk_names:
         try:
@@ -509,7 +1016,7 @@ def delete_disks_if_needed(project_id, zone, disk_names):
     return all_ok
 
 
-def delete_free_resources(project_id, instance_info):
+def delete_free_resources(project_id, instance_info, confirm=True):
     instance_name = instance_info["name"]
     zone = instance_info["zone"]
 
@@ -518,12 +1025,13 @@ def delete_free_resources(project_id, instance_info):
     print(f"- 实例: {instance_name} ({zone})")
     print(f"- 相关磁盘（如仍存在）")
     print(f"- 防火墙规则: {', '.join(FIREWALL_RULES_TO_CLEAN)}")
-    confirm = input("请输入 DELETE 确认删除: ").strip()
-    if confirm != "DELETE":
-        print("已取消删除操作。")
-        return False
+    if confirm:
+        answer = input("请输入 DELETE 确认删除: ").strip()
+        if answer != "DELETE":
+            print("已取消删除操作。")
+            return False
 
-    instance_client = compute_v1.InstancesClient()
+    instance_client = compute_client("InstancesClient")
     disk_names = []
     try:
         inst = instance_client.get(project=project_id, zone=zone, instance=instance_name)
@@ -592,7 +1100,12 @@ def build_remote_download_command(script_url):
     )
 
 
-def build_remote_exec_command(project_id, instance_info, remote_config, remote_command):
+def gcloud_quiet_flag(remote_config):
+    # 批处理模式没有人应答，首次使用时 gcloud 生成 SSH 密钥的提示会让进程一直挂起
+    return ["--quiet"] if remote_config.get("quiet") else []
+
+
+def build_remote_exec_command(project_id, instance_info, remote_config, remote_command, ssh_options=()):
     instance_name = instance_info["name"]
     zone = instance_info["zone"]
     method = remote_config.get("method")
@@ -609,7 +1122,7 @@ def build_remote_exec_command(project_id, instance_info, remote_config, remote_c
             zone,
             "--command",
             remote_command,
-        ]
+        ] + gcloud_quiet_flag(remote_config) + [f"--ssh-flag=-o {option}" for option in ssh_options]
     if method == "ssh":
         host = instance_info.get("external_ip")
         if not host or host == "-":
@@ -622,6 +1135,8 @@ def build_remote_exec_command(project_id, instance_info, remote_config, remote_c
         key_path = remote_config.get("key")
         if key_path:
             cmd += ["-i", key_path]
+        for option in ssh_options:
+            cmd += ["-o", option]
         cmd += [f"{remote_config.get('user')}@{host}", remote_command]
         return cmd
 
@@ -645,7 +1160,7 @@ def build_remote_upload_command(project_id, instance_info, remote_config, local_
             project_id,
             "--zone",
             zone,
-        ]
+        ] + gcloud_quiet_flag(remote_config)
     if method == "ssh":
         if shutil.which("scp") is None:
             print_warning("未找到 scp 命令，无法上传文件。")
@@ -668,6 +1183,20 @@ def build_remote_upload_command(project_id, instance_info, remote_config, local_
     return None
 
 
+def run_command(cmd, capture=False, timeout=None):
+    # 子进程输出跟随 sys.stdout，批处理模式下会被转到 stderr，保证 stdout 只有 JSON
+    sys.stdout.flush()
+    span_name = " ".join(cmd[:3]) if cmd[0] == "gcloud" else cmd[0]
+    with TRACER.span(span_name, "subprocess") as span:
+        if capture:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+        else:
+            result = subprocess.run(cmd, stdout=sys.stdout, timeout=timeout)
+        if result.returncode != 0:
+            span["outcome"] = f"exit_{result.returncode}"
+        return result
+
+
 def run_remote_script(project_id, instance_info, script_key, remote_config):
     script_url = REMOTE_SCRIPT_URLS.get(script_key)
     if not script_url:
@@ -680,7 +1209,7 @@ def run_remote_script(project_id, instance_info, script_key, remote_config):
 
     print_info(f"正在远程执行脚本: {script_url}")
     try:
-        result = subprocess.run(cmd)
+        result = run_command(cmd)
         if result.returncode == 0:
             print_success("远程脚本执行完成。")
             return True
@@ -726,7 +1255,7 @@ def deploy_dae_config(project_id, instance_info, remote_config):
 
     print_info("正在上传 config.dae ...")
     try:
-        result = subprocess.run(upload_cmd)
+        result = run_command(upload_cmd)
         if result.returncode != 0:
             print_warning(f"上传失败，退出码: {result.returncode}")
             return False
@@ -749,7 +1278,7 @@ def deploy_dae_config(project_id, instance_info, remote_config):
 
     print_info("正在应用配置并重启 dae ...")
     try:
-        result = subprocess.run(exec_cmd)
+        result = run_command(exec_cmd)
         if result.returncode == 0:
             print_success("配置已更新并重启 dae。")
             return True
@@ -760,11 +1289,1074 @@ def deploy_dae_config(project_id, instance_info, remote_config):
         return False
 
 
+# ------------------------------------------------
+# 开机自动配置 (startup-script + 元数据)
+# ------------------------------------------------
+
+PROVISION_STEPS = ("apt", "dae", "config", "net_iptables", "net_shutdown")
+PROVISION_SCRIPT_FILES = {
+    "apt": "apt.sh",
+    "dae": "dae.sh",
+    "net_iptables": "net_iptables.sh",
+    "net_shutdown": "net_shutdown.sh",
+}
+PROVISION_NAMESPACE = "gcp-free"
+# 脚本和 config.dae 以此前缀写入元数据，配置结束后从实例上移除
+PROVISION_PAYLOAD_PREFIX = "gcp-free-"
+# GCE 元数据限制：单个值 256KB，总计 512KB
+METADATA_VALUE_LIMIT = 256 * 1024
+METADATA_TOTAL_LIMIT = 512 * 1024
+
+STARTUP_SCRIPT_TEMPLATE = """#!/bin/bash
+# gcp_free 开机自动配置，由 gcp.py 生成
+MD="http://metadata.google.internal/computeMetadata/v1/instance"
+MARKER="/var/lib/gcp-free/provisioned"
+STEP_DIR="/var/lib/gcp-free/steps"
+STEPS="__STEPS__"
+BAKED="__BAKED__"
+
+report() {
+    curl -s -X PUT --data "$2" -H "Metadata-Flavor: Google" "$MD/guest-attributes/__NAMESPACE__/$1" >/dev/null 2>&1 || true
+    echo "gcp-free-provision: $1=$2"
+}
+
+fetch() {
+    curl -sf -H "Metadata-Flavor: Google" "$MD/attributes/$1"
+}
+
+run_script() {
+    tmp=$(mktemp /tmp/gcp_free.XXXXXX.sh)
+    if ! fetch "gcp-free-script-$1" > "$tmp"; then
+        rm -f "$tmp"
+        return 1
+    fi
+    $2 "$tmp" < /dev/null
+    rc=$?
+    rm -f "$tmp"
+    return $rc
+}
+
+install_config() {
+    mkdir -p /usr/local/etc/dae
+    fetch gcp-free-config-dae > /usr/local/etc/dae/config.dae || return 1
+    chmod 600 /usr/local/etc/dae/config.dae
+    systemctl enable dae && systemctl restart dae
+}
+
+reset_traffic_counters() {
+    if command -v vnstat >/dev/null 2>&1; then
+        iface=$(ip route | awk '/default/ {print $5; exit}')
+        systemctl stop vnstat
+        vnstat --remove --force -i "$iface"
+        vnstat --add -i "$iface"
+        systemctl start vnstat
+    fi
+    rm -f /var/log/traffic_monitor.log
+}
+
+fetch_instance_id() {
+    for i in 1 2 3 4 5 6 7 8 9 10; do
+        id=$(curl -sf -H "Metadata-Flavor: Google" "$MD/id")
+        if [ -n "$id" ]; then
+            echo "$id"
+            return 0
+        fi
+        sleep 3
+    done
+    return 1
+}
+
+new_instance() {
+    # 镜像里的流量统计和步骤记录属于来源实例，新实例要清掉后重新开始
+    reset_traffic_counters
+    rm -f "$STEP_DIR"/*
+    echo "$INSTANCE_ID" > "$MARKER"
+}
+
+# 每次开机都会执行 startup-script。标记文件记录磁盘所属的实例 ID，
+# 步骤记录保证重启后只执行尚未完成的步骤
+INSTANCE_ID=$(fetch_instance_id)
+mkdir -p "$STEP_DIR"
+if [ -f "$MARKER" ]; then
+    MARKED_ID=$(cat "$MARKER")
+    if [ -z "$INSTANCE_ID" ]; then
+        # 读不到实例 ID 时无法判断是否为新实例，宁可不重置，避免月中清空流量统计
+        echo "gcp-free-provision: 无法读取实例 ID，跳过流量统计检查"
+    elif [ -z "$MARKED_ID" ]; then
+        echo "$INSTANCE_ID" > "$MARKER"
+    elif [ "$MARKED_ID" != "$INSTANCE_ID" ]; then
+        # 标记中的实例 ID 不同，说明是从自制镜像新建的实例
+        new_instance
+    fi
+elif [ "$BAKED" = "1" ]; then
+    # 从自制镜像新建但没有标记：镜像来源实例是通过菜单逐步配置的，同样要清掉残留的流量统计。
+    # 读不到 ID 时写入空标记，下次开机补写且不重置
+    new_instance
+else
+    echo "$INSTANCE_ID" > "$MARKER"
+fi
+
+PENDING=""
+for step in $STEPS; do
+    [ -f "$STEP_DIR/$step" ] || PENDING="$PENDING $step"
+done
+if [ -z "$PENDING" ]; then
+    report status done
+    exit 0
+fi
+
+report status running
+# 配置途中被关机（例如紧接着刷 CPU）时，下次开机只执行剩余步骤；
+# 被打断的 apt/dpkg 需要先修复，否则后续安装会报 "dpkg was interrupted"
+if command -v dpkg >/dev/null 2>&1; then
+    dpkg --configure -a < /dev/null || true
+fi
+for step in $PENDING; do
+    report step "$step"
+    case "$step" in
+        config) install_config ;;
+        dae) run_script dae sh ;;
+        *) run_script "$step" bash ;;
+    esac
+    if [ $? -ne 0 ]; then
+        report status "failed:$step"
+        exit 1
+    fi
+    touch "$STEP_DIR/$step"
+done
+report status done
+"""
+
+
+def read_local_file(*parts):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), *parts)
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def build_provision_metadata(steps, baked=False):
+    unknown = [step for step in steps if step not in PROVISION_STEPS]
+    if unknown:
+        raise ValueError(f"未知的配置步骤: {', '.join(unknown)}")
+    ordered = [step for step in PROVISION_STEPS if step in steps]
+
+    startup_script = STARTUP_SCRIPT_TEMPLATE.replace("__STEPS__", " ".join(ordered))
+    startup_script = startup_script.replace("__NAMESPACE__", PROVISION_NAMESPACE)
+    startup_script = startup_script.replace("__BAKED__", "1" if baked else "0")
+    items = {
+        "enable-guest-attributes": "TRUE",
+        "startup-script": startup_script,
+    }
+    for step in ordered:
+        if step == "config":
+            items["gcp-free-config-dae"] = read_local_file("config.dae")
+        else:
+            items[f"gcp-free-script-{step}"] = read_local_file("scripts", PROVISION_SCRIPT_FILES[step])
+
+    total = 0
+    for key, value in items.items():
+        size = len(key.encode("utf-8")) + len(value.encode("utf-8"))
+        if size > METADATA_VALUE_LIMIT:
+            raise ValueError(f"元数据 {key} 超过 256KB 限制")
+        total += size
+    if total > METADATA_TOTAL_LIMIT:
+        raise ValueError("元数据总大小超过 512KB 限制")
+    return items
+
+
+def select_provision_steps():
+    choice = input("\n是否在开机时通过 startup-script 自动完成配置 (换源/安装 dae/部署 config.dae/流量监控)? (y/N): ").strip().lower()
+    if choice not in ("y", "yes"):
+        return []
+    steps = ["apt", "dae", "config"]
+    script_key = select_traffic_monitor_script()
+    if script_key:
+        steps.append(script_key)
+    return steps
+
+
+def parse_serial_provision_state(contents, state):
+    for line in contents.splitlines():
+        marker = line.find("gcp-free-provision: ")
+        if marker < 0:
+            continue
+        key, _, value = line[marker + len("gcp-free-provision: "):].strip().partition("=")
+        if key:
+            state[key] = value
+    return state
+
+
+def read_provision_state(instance_client, project_id, zone, instance_name, serial_state):
+    if not serial_state.get("use_serial"):
+        try:
+            response = instance_client.get_guest_attributes(
+                project=project_id,
+                zone=zone,
+                instance=instance_name,
+                query_path=f"{PROVISION_NAMESPACE}/",
+            )
+            return {item.key: item.value for item in response.query_value.items}
+        except Exception as e:
+            if is_not_found_error(e):
+                return {}
+            print_warning(f"读取 guest attributes 失败 ({e})，改为读取串口输出。")
+            serial_state["use_serial"] = True
+
+    output = instance_client.get_serial_port_output(
+        project=project_id,
+        zone=zone,
+        instance=instance_name,
+        port=1,
+        start=serial_state.get("next", 0),
+    )
+    serial_state["next"] = output.next_
+    return parse_serial_provision_state(output.contents or "", serial_state.setdefault("attrs", {}))
+
+
+def clear_provision_payload(project_id, zone, instance_name):
+    # config.dae 含节点和订阅链接，不能长期留在任何进程都能读取的元数据里
+    instance_client = compute_client("InstancesClient")
+    inst = instance_client.get(project=project_id, zone=zone, instance=instance_name)
+    items = list(inst.metadata.items or []) if inst.metadata else []
+    keep = [item for item in items if not item.key.startswith(PROVISION_PAYLOAD_PREFIX)]
+    if len(keep) == len(items):
+        return False
+    metadata = compute_v1.Metadata(
+        fingerprint=inst.metadata.fingerprint,
+        items=[compute_v1.Items(key=item.key, value=item.value) for item in keep],
+    )
+    operation = instance_client.set_metadata(project=project_id, zone=zone, instance=instance_name, metadata_resource=metadata)
+    operation = wait_for_operation(project_id, zone, operation.name)
+    if operation.error:
+        raise RuntimeError(str(operation.error))
+    return True
+
+
+def finish_provision(project_id, zone, instance_name, result):
+    try:
+        if clear_provision_payload(project_id, zone, instance_name):
+            print_info("已从实例元数据中移除配置脚本和 config.dae。")
+        result["payload_cleared"] = True
+    except Exception as e:
+        print_warning(f"移除元数据中的 config.dae 失败 ({e})，请在控制台手动删除 {PROVISION_PAYLOAD_PREFIX}* 元数据。")
+        result["payload_cleared"] = False
+    return result
+
+
+def wait_for_provision(project_id, zone, instance_name, timeout=1200, interval=10):
+    instance_client = compute_client("InstancesClient")
+    print_info(f"正在等待 {instance_name} 开机配置完成 (最长 {timeout // 60} 分钟)...")
+    started = time.time()
+    serial_state = {}
+    last_step = None
+    while time.time() - started < timeout:
+        state = read_provision_state(instance_client, project_id, zone, instance_name, serial_state)
+        status = state.get("status", "")
+        step = state.get("step")
+        if step and step != last_step:
+            print_info(f"正在执行: {step}")
+            last_step = step
+        if status == "done":
+            elapsed = round(time.time() - started, 1)
+            print_success(f"开机配置完成，耗时 {elapsed} 秒。")
+            return finish_provision(project_id, zone, instance_name, {"status": "done", "elapsed": elapsed})
+        if status.startswith("failed"):
+            print_warning(f"开机配置失败: {status}。可通过串口输出或 journalctl -u google-startup-scripts 查看日志。")
+            result = {"status": status, "step": step, "elapsed": round(time.time() - started, 1)}
+            return finish_provision(project_id, zone, instance_name, result)
+        traced_sleep(interval, "provision.poll")
+    print_warning("等待开机配置超时，配置脚本和 config.dae 仍保留在实例元数据中，配置完成后请再次等待或手动删除。")
+    return {"status": "timeout", "step": last_step, "elapsed": round(time.time() - started, 1)}
+
+
+# ------------------------------------------------
+# 自制镜像 (把配置好的实例启动盘做成镜像族)
+# ------------------------------------------------
+
+BAKED_FAMILY_PREFIX = "gcp-free-"
+DEFAULT_BAKED_FAMILY = "gcp-free-golden"
+
+
+def list_baked_image_options(project_id):
+    images_client = compute_client("ImagesClient")
+    families = set()
+    for image in images_client.list(project=project_id):
+        family = image.family or ""
+        deprecated = image.deprecated.state if image.deprecated else ""
+        if family.startswith(BAKED_FAMILY_PREFIX) and not deprecated:
+            families.add(family)
+    return [
+        {"name": f"自制镜像 ({family})", "project": project_id, "family": family, "baked": True}
+        for family in sorted(families)
+    ]
+
+
+def wait_for_global_operation(project_id, operation_name, timeout=1800):
+    operation_client = compute_client("GlobalOperationsClient")
+    started = time.time()
+    while True:
+        # wait 最多阻塞 2 分钟，镜像这类长操作需要循环等待
+        operation = operation_client.wait(project=project_id, operation=operation_name)
+        if str(operation.status).endswith("DONE"):
+            return operation
+        if time.time() - started > timeout:
+            raise TimeoutError(f"等待操作 {operation_name} 超时 ({timeout} 秒)，当前状态: {operation.status}")
+
+
+def prune_baked_images(project_id, family, keep):
+    images_client = compute_client("ImagesClient")
+    images = [image for image in images_client.list(project=project_id) if image.family == family]
+    images.sort(key=lambda image: image.creation_timestamp or "", reverse=True)
+    deleted = []
+    for image in images[keep:]:
+        try:
+            operation = images_client.delete(project=project_id, image=image.name)
+            wait_for_global_operation(project_id, operation.name)
+            print_info(f"已删除旧镜像: {image.name}")
+            deleted.append(image.name)
+        except Exception as e:
+            print_warning(f"删除旧镜像失败: {image.name} ({e})")
+    return deleted
+
+
+def bake_image(project_id, instance_info, family=DEFAULT_BAKED_FAMILY, keep=2):
+    instance_name = instance_info["name"]
+    zone = instance_info["zone"]
+    if not family.startswith(BAKED_FAMILY_PREFIX):
+        family = BAKED_FAMILY_PREFIX + family
+
+    instance_client = compute_client("InstancesClient")
+    images_client = compute_client("ImagesClient")
+
+    try:
+        inst = instance_client.get(project=project_id, zone=zone, instance=instance_name)
+        boot_disks = [disk for disk in inst.disks if disk.boot] or list(inst.disks)
+        if not boot_disks or not boot_disks[0].source:
+            print_warning("未找到实例的启动盘。")
+            return None
+        source_disk = boot_disks[0].source
+
+        image_name = f"{family}-{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}"
+        image = compute_v1.Image()
+        image.name = image_name
+        image.family = family
+        image.source_disk = source_disk
+        image.storage_locations = [zone.rsplit("-", 1)[0]]
+        image.description = f"gcp_free 自制镜像，来源实例 {instance_name} ({zone})"
+
+        # 直接从运行中的启动盘制作（崩溃一致性快照）。不关机重启：e2-micro 每次启停都会重新分配
+        # CPU 平台，关机制作会让刷到的 AMD 实例可能回到 Intel
+        print_info(f"正在制作镜像 {image_name} (约 3-10 分钟，实例保持运行)...")
+        request = compute_v1.InsertImageRequest(project=project_id, image_resource=image, force_create=True)
+        operation = images_client.insert(request=request)
+        operation = wait_for_global_operation(project_id, operation.name)
+
+        if operation.error:
+            print_warning(f"镜像制作失败: {operation.error}")
+            return None
+        print_success(f"镜像已制作完成: {image_name} (镜像族 {family})")
+
+        pruned = prune_baked_images(project_id, family, keep) if keep else []
+        return {"image": image_name, "family": family, "source_disk": source_disk.split("/")[-1], "pruned": pruned}
+    except Exception as e:
+        print(f"\n[失败] 操作中止: {e}")
+        traceback.print_exc()
+        return None
+
+
+# ------------------------------------------------
+# 流量汇总 (并发读取各实例的 vnStat 计数与监控日志)
+# ------------------------------------------------
+
+# 与 net_iptables.sh / net_shutdown.sh 中的 LIMIT 保持一致
+TRAFFIC_LIMIT_GB = 180
+TRAFFIC_LOG_FILE = "/var/log/traffic_monitor.log"
+TRAFFIC_LOG_LINES = 20
+TRAFFIC_SAMPLE_DAYS = 40
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "gcp_free")
+TRAFFIC_CACHE_FILE = os.path.join(CACHE_DIR, "traffic.json")
+GB = 1024**3
+
+
+def ssh_multiplex_options():
+    # 每台主机复用一条 SSH 主连接，10 分钟内再次查看无需重新握手
+    control_dir = os.path.join(CACHE_DIR, "ssh")
+    os.makedirs(control_dir, mode=0o700, exist_ok=True)
+    return [
+        "ControlMaster=auto",
+        f"ControlPath={control_dir}/%C",
+        "ControlPersist=10m",
+        "BatchMode=yes",
+        # BatchMode 下无法交互确认主机指纹，首次连接的新实例自动记录，已记录的指纹变化时仍会拒绝
+        "StrictHostKeyChecking=accept-new",
+        "ConnectTimeout=10",
+    ]
+
+
+def build_traffic_command(log_offset=0, log_inode=""):
+    # 一次远程调用取回时间、网卡、vnStat 计数和上次查看之后新增的日志；
+    # 日志被监控脚本删除重建（inode 变化或变短）时从头读取
+    return (
+        "IF=$(ip route | grep default | awk '{print $5}' | head -n1);"
+        'echo "@@time $(date +%s)";'
+        'echo "@@iface $IF";'
+        'echo "@@vnstat $(vnstat -i "$IF" --oneline b 2>/dev/null)";'
+        f"LOG={TRAFFIC_LOG_FILE}; START={int(log_offset)};"
+        "set -- $(stat -c '%s %i' \"$LOG\" 2>/dev/null || echo 0 0);"
+        f'if [ "$1" -lt "$START" ] || [ "$2" != "{log_inode}" ]; then START=0; fi;'
+        'echo "@@log $1 $2 $START";'
+        f'if [ "$1" -gt "$START" ]; then tail -c +$((START + 1)) "$LOG" | tail -n {TRAFFIC_LOG_LINES}; fi;'
+        "true"
+    )
+
+
+def parse_vnstat_oneline(raw):
+    # vnStat 2.x 输出 15 个字段，1.x 多一个别名字段；月份 TX 分别在第 10 / 11 个字段。
+    # 监控脚本用 cut -f 5 取值判断是否超限，这里原样记录以便对照
+    fields = raw.split(";")
+    if len(fields) < 15:
+        return None
+    shift = len(fields) - 15
+    try:
+        return {
+            "month": fields[7 + shift],
+            "tx_month": int(fields[9 + shift]),
+            "monitor_tx": int(fields[4]),
+        }
+    except ValueError:
+        return None
+
+
+def parse_traffic_output(text):
+    sample = {"log_lines": []}
+    in_log = False
+    for line in text.splitlines():
+        if in_log:
+            if line.strip():
+                sample["log_lines"].append(line.rstrip())
+            continue
+        if line.startswith("@@time "):
+            sample["time"] = int(line.split()[1])
+        elif line.startswith("@@iface"):
+            sample["iface"] = line[len("@@iface") :].strip()
+        elif line.startswith("@@vnstat"):
+            sample["vnstat"] = parse_vnstat_oneline(line[len("@@vnstat") :].strip())
+        elif line.startswith("@@log "):
+            size, inode, _ = line.split()[1:4]
+            sample["log_size"] = int(size)
+            sample["log_inode"] = inode
+            in_log = True
+    if "time" not in sample:
+        raise ValueError("远程输出中缺少时间戳")
+    return sample
+
+
+def load_traffic_cache():
+    try:
+        with open(TRAFFIC_CACHE_FILE, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {"hosts": {}}
+    cache.setdefault("hosts", {})
+    return cache
+
+
+def save_traffic_cache(cache):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{TRAFFIC_CACHE_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(tmp_path, TRAFFIC_CACHE_FILE)
+
+
+def traffic_cache_key(project_id, instance_info):
+    return f"{project_id}/{instance_info['zone']}/{instance_info['name']}"
+
+
+def collect_traffic(project_id, instance_info, remote_config, entry, timeout=60):
+    remote_command = build_traffic_command(entry.get("log_size", 0), entry.get("log_inode", ""))
+    cmd = build_remote_exec_command(project_id, instance_info, remote_config, remote_command, ssh_multiplex_options())
+    if not cmd:
+        raise RuntimeError("无法构造远程命令")
+    result = run_command(cmd, capture=True, timeout=timeout)
+    if result.returncode != 0:
+        detail = (result.stderr or "").strip().splitlines()
+        raise RuntimeError(f"退出码 {result.returncode}: {detail[-1] if detail else '无输出'}")
+    return parse_traffic_output(result.stdout)
+
+
+def update_traffic_entry(entry, sample):
+    entry["iface"] = sample.get("iface") or entry.get("iface")
+    entry["log_size"] = sample.get("log_size", 0)
+    entry["log_inode"] = sample.get("log_inode", "")
+    entry["log_tail"] = (entry.get("log_tail", []) + sample["log_lines"])[-TRAFFIC_LOG_LINES:]
+    vnstat = sample.get("vnstat")
+    if vnstat:
+        samples = [s for s in entry.get("samples", []) if s[0] >= sample["time"] - TRAFFIC_SAMPLE_DAYS * 86400]
+        samples.append([sample["time"], vnstat["tx_month"], vnstat["month"], vnstat["monitor_tx"]])
+        entry["samples"] = samples
+
+
+def month_bounds(timestamp):
+    # 实例默认使用 UTC 时区，vnStat 的本月统计也按 UTC 切换月份，这里不能用本机时区
+    tm = time.gmtime(timestamp)
+    start = calendar.timegm((tm.tm_year, tm.tm_mon, 1, 0, 0, 0))
+    if tm.tm_mon == 12:
+        end = calendar.timegm((tm.tm_year + 1, 1, 1, 0, 0, 0))
+    else:
+        end = calendar.timegm((tm.tm_year, tm.tm_mon + 1, 1, 0, 0, 0))
+    return start, end
+
+
+def traffic_report_row(instance_info, entry, limit_gb=TRAFFIC_LIMIT_GB):
+    row = {"name": instance_info["name"], "zone": instance_info["zone"], "limit_gb": limit_gb}
+    samples = entry.get("samples") or []
+    if not samples:
+        return dict(row, status="unknown")
+    sampled_at, tx, month, monitor_tx = samples[-1]
+    month_start, month_end = month_bounds(sampled_at)
+
+    # 优先用 24 小时内（至少间隔 10 分钟）的缓存样本计算近期速率，否则用本月平均速率
+    rate = tx / max(sampled_at - month_start, 1)
+    basis = "month"
+    for t, previous_tx, previous_month, _ in samples[:-1]:
+        if previous_month == month and 600 <= sampled_at - t <= 86400 and tx >= previous_tx:
+            rate = (tx - previous_tx) / (sampled_at - t)
+            basis = "recent"
+            break
+    projected = tx + rate * max(month_end - sampled_at, 0)
+
+    if tx >= limit_gb * GB:
+        status = "over"
+    elif projected >= limit_gb * GB:
+        status = "at_risk"
+    else:
+        status = "ok"
+    return dict(
+        row,
+        iface=entry.get("iface"),
+        month=month,
+        tx_gb=round(tx / GB, 2),
+        monitor_tx_gb=round(monitor_tx / GB, 2),
+        percent=round(tx / (limit_gb * GB) * 100, 1),
+        burn_gb_per_day=round(rate * 86400 / GB, 2),
+        burn_basis=basis,
+        projected_gb=round(projected / GB, 2),
+        status=status,
+        sampled_at=sampled_at,
+        last_log=(entry.get("log_tail") or [None])[-1],
+    )
+
+
+def collect_fleet_traffic(project_id, instances, remote_config, parallel=8, limit_gb=TRAFFIC_LIMIT_GB, timeout=60):
+    cache = load_traffic_cache()
+    hosts = cache["hosts"]
+    running = [inst for inst in instances if inst.get("status", "RUNNING") == "RUNNING"]
+
+    def fetch(inst):
+        entry = hosts.get(traffic_cache_key(project_id, inst), {})
+        try:
+            return collect_traffic(project_id, inst, remote_config, entry, timeout), None
+        except Exception as e:
+            return None, str(e)
+
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        results = executor.map(fetch, running)
+        fetched = dict(zip([(inst["name"], inst["zone"]) for inst in running], results))
+
+    rows = []
+    for inst in instances:
+        entry = hosts.setdefault(traffic_cache_key(project_id, inst), {})
+        sample, error = fetched.get((inst["name"], inst["zone"]), (None, None))
+        new_lines = []
+        if sample:
+            update_traffic_entry(entry, sample)
+            new_lines = sample["log_lines"]
+        row = traffic_report_row(inst, entry, limit_gb)
+        row["ok"] = sample is not None
+        row["new_log_lines"] = new_lines
+        if error:
+            row["error"] = error
+        elif not sample:
+            row["error"] = f"实例状态为 {inst.get('status')}，未采集"
+        # 采集失败时沿用缓存中的上一次结果
+        row["stale"] = sample is None and "tx_gb" in row
+        rows.append(row)
+    save_traffic_cache(cache)
+    return rows
+
+
+def print_traffic_report(rows):
+    status_labels = {
+        "ok": "\033[92m正常\033[0m",
+        "at_risk": "\033[93m预计超限\033[0m",
+        "over": "\033[91m已超限\033[0m",
+        "unknown": "未知",
+    }
+    print("\n--- 流量汇总 (出站 TX，本月) ---")
+    for row in rows:
+        if "tx_gb" not in row:
+            print(f"{row['name']:<20} | 区域: {row['zone']:<15} | {status_labels['unknown']} | {row.get('error', '')}")
+            continue
+        stale = " (缓存)" if row["stale"] else ""
+        print(
+            f"{row['name']:<20} | 区域: {row['zone']:<15} | 已用: {row['tx_gb']:>7.2f}/{row['limit_gb']} GB "
+            f"({row['percent']:>5.1f}%) | 速率: {row['burn_gb_per_day']:>6.2f} GB/天 | 月底预计: {row['projected_gb']:>7.2f} GB | "
+            f"{status_labels[row['status']]}{stale}"
+        )
+        if row.get("last_log"):
+            print(f"    最近日志: {row['last_log']}")
+        if row.get("error"):
+            print(f"    采集失败: {row['error']}")
+    known = [row for row in rows if "tx_gb" in row]
+    total = sum(row["tx_gb"] for row in known)
+    at_risk = [row["name"] for row in known if row["status"] != "ok"]
+    print(f"合计: {len(rows)} 台，已用 {total:.2f} GB；预计超限或已超限: {', '.join(at_risk) or '无'}")
+
+
+# ------------------------------------------------
+# 批处理模式 (无交互，stdout 输出 JSON lines)
+# ------------------------------------------------
+
+JSON_STREAM = sys.stdout
+JSON_LOCK = threading.Lock()
+MONITOR_SCRIPTS = ("net_iptables", "net_shutdown")
+
+
+class BatchError(Exception):
+    pass
+
+
+def emit_json(record):
+    with JSON_LOCK:
+        JSON_STREAM.write(json.dumps(record, ensure_ascii=False) + "\n")
+        JSON_STREAM.flush()
+
+
+def find_os_config(family, project_id):
+    for os_config in OS_IMAGE_OPTIONS:
+        if family in (os_config["family"], os_config["name"]):
+            return os_config
+    if family.startswith(BAKED_FAMILY_PREFIX):
+        return {"name": f"自制镜像 ({family})", "project": project_id, "family": family, "baked": True}
+    raise BatchError(f"未知的系统镜像: {family}")
+
+
+def default_zone_for(region):
+    for region_config in REGION_OPTIONS:
+        if region_config["region"] == region:
+            return region_config["default_zone"]
+    raise BatchError(f"未知的区域: {region}")
+
+
+def remote_config_from_options(options):
+    method = options.get("method") or "gcloud"
+    if method == "gcloud":
+        if shutil.which("gcloud") is None:
+            raise BatchError("本机未发现 gcloud")
+        return {"method": "gcloud", "quiet": True}
+    if method == "ssh":
+        if shutil.which("ssh") is None:
+            raise BatchError("本机未发现 ssh")
+        return {
+            "method": "ssh",
+            "user": options.get("user") or getpass.getuser(),
+            "port": str(options.get("port") or "22"),
+            "key": options.get("key") or "",
+        }
+    raise BatchError(f"未知的远程执行方式: {method}")
+
+
+def resolve_target(project_id, target):
+    inst = find_instance(project_id, target["name"], target.get("zone"))
+    if not inst:
+        raise BatchError(f"找不到实例: {target['name']}")
+    # 记住解析出的可用区，后续步骤直接按可用区 get，不再扫描整个项目
+    target["zone"] = inst["zone"]
+    return inst
+
+
+def action_create(project_id, target, step, context):
+    zone = target.get("zone") or step.get("zone")
+    if not zone:
+        zone = default_zone_for(step.get("region") or REGION_OPTIONS[0]["region"])
+    os_config = find_os_config(step.get("os") or OS_IMAGE_OPTIONS[0]["family"], project_id)
+    provision_steps = step.get("provision") or []
+    if isinstance(provision_steps, str):
+        provision_steps = [p.strip() for p in provision_steps.split(",") if p.strip()]
+    created = create_instance(project_id, zone, os_config, instance_name=target["name"], provision_steps=provision_steps)
+    if not created:
+        raise BatchError("实例创建失败")
+    target["zone"] = zone
+    if (provision_steps or os_config.get("baked")) and step.get("wait_provision"):
+        provision = wait_for_provision(project_id, zone, target["name"], timeout=int(step.get("provision_timeout") or 1200))
+        created = dict(created, provision=provision)
+        if provision["status"] != "done":
+            raise BatchError(f"开机配置未完成: {provision['status']}")
+    elif "config" in provision_steps:
+        print_warning("未等待开机配置完成，config.dae 会一直保留在实例元数据中，建议加上 --wait-provision。")
+    return created
+
+
+def action_reroll(project_id, target, step, context):
+    inst = resolve_target(project_id, target)
+    result = reroll_cpu_loop(
+        project_id,
+        inst,
+        cpu_keyword=step.get("cpu") or "AMD",
+        max_attempts=step.get("max_attempts"),
+    )
+    if not result["matched"]:
+        raise BatchError(f"未刷到目标 CPU，当前: {result['cpu_platform']}")
+    return result
+
+
+def action_firewall(project_id, target, step, context):
+    inst = resolve_target(project_id, target)
+    network = inst.get("network") or "global/networks/default"
+    result = {"network": network}
+    if step.get("allow_ingress"):
+        if not add_allow_all_ingress(project_id, network):
+            raise BatchError("入站规则创建失败")
+        result["allow_ingress"] = True
+    if step.get("deny_cdn"):
+        ips = read_cdn_ips_for_rule(step.get("cdn_file") or "cdnip.txt")
+        if not add_deny_cdn_egress(project_id, ips, network):
+            raise BatchError("出站拒绝规则创建失败")
+        result["deny_cdn"] = len(ips)
+    return result
+
+
+def make_remote_script_action(script_key):
+    def action(project_id, target, step, context):
+        inst = resolve_target(project_id, target)
+        if not run_remote_script(project_id, inst, script_key, context["remote"]):
+            raise BatchError(f"远程脚本执行失败: {script_key}")
+        return {"script": script_key}
+
+    return action
+
+
+def action_config(project_id, target, step, context):
+    inst = resolve_target(project_id, target)
+    if not deploy_dae_config(project_id, inst, context["remote"]):
+        raise BatchError("config.dae 部署失败")
+    return {}
+
+
+def action_monitor(project_id, target, step, context):
+    script_key = step.get("script") or "net_shutdown"
+    if script_key not in MONITOR_SCRIPTS:
+        raise BatchError(f"未知的流量监控脚本: {script_key}")
+    return make_remote_script_action(script_key)(project_id, target, step, context)
+
+
+def action_bake(project_id, target, step, context):
+    inst = resolve_target(project_id, target)
+    keep = step.get("keep")
+    result = bake_image(project_id, inst, step.get("family") or DEFAULT_BAKED_FAMILY, 2 if keep is None else int(keep))
+    if not result:
+        raise BatchError("镜像制作失败")
+    return result
+
+
+def action_delete(project_id, target, step, context):
+    inst = find_instance(project_id, target["name"], target.get("zone"))
+    if not inst:
+        return {"deleted": False, "reason": "not found"}
+    if not delete_free_resources(project_id, inst, confirm=False):
+        raise BatchError("删除失败")
+    return {"deleted": True}
+
+
+BATCH_ACTIONS = {
+    "create": action_create,
+    "reroll": action_reroll,
+    "firewall": action_firewall,
+    "apt": make_remote_script_action("apt"),
+    "dae": make_remote_script_action("dae"),
+    "config": action_config,
+    "monitor": action_monitor,
+    "bake": action_bake,
+    "delete": action_delete,
+}
+REMOTE_ACTIONS = ("apt", "dae", "config", "monitor")
+
+
+def run_step(project_id, target, step, context):
+    action = step["action"]
+    started = time.time()
+    record = {"project": project_id, "target": target["name"], "action": action}
+    try:
+        result = BATCH_ACTIONS[action](project_id, target, step, context)
+        record.update(ok=True, result=result)
+    except Exception as e:
+        record.update(ok=False, error=str(e))
+    record["zone"] = target.get("zone")
+    record["elapsed"] = round(time.time() - started, 3)
+    emit_json(record)
+    return record["ok"]
+
+
+def run_target(project_id, target, steps, context):
+    for step in steps:
+        if not run_step(project_id, target, step, context) and not context["continue_on_error"]:
+            return False
+    return True
+
+
+def parse_target(value):
+    if isinstance(value, dict):
+        return {"name": value["name"], "zone": value.get("zone")}
+    zone, _, name = value.rpartition("/")
+    return {"name": name, "zone": zone or None}
+
+
+def run_plan(plan):
+    project_id = plan.get("project") or os.environ.get("GOOGLE_CLOUD_PROJECT")
+    if not project_id:
+        raise BatchError("未指定项目 ID (--project 或 plan 中的 project)")
+
+    steps = plan.get("steps") or []
+    for step in steps:
+        if step.get("action") not in BATCH_ACTIONS:
+            raise BatchError(f"未知的操作: {step.get('action')}")
+    targets = [parse_target(t) for t in plan.get("targets") or []]
+    if not targets:
+        raise BatchError("未指定目标实例")
+
+    context = {"remote": None, "continue_on_error": bool(plan.get("continue_on_error"))}
+    if any(step["action"] in REMOTE_ACTIONS for step in steps):
+        context["remote"] = remote_config_from_options(plan.get("remote") or {})
+
+    parallel = max(1, int(plan.get("parallel") or 1))
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        results = list(executor.map(lambda t: run_target(project_id, t, steps, context), targets))
+    return all(results)
+
+
+def load_plan_file(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def parse_api_rate(value):
+    group, sep, rate = value.partition("=")
+    if not sep or group not in API_RATE_LIMITS:
+        raise argparse.ArgumentTypeError(f"格式应为 GROUP=QPS，GROUP 可选: {', '.join(API_RATE_LIMITS)}")
+    try:
+        qps = float(rate)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的速率: {rate}")
+    if qps < 0:
+        raise argparse.ArgumentTypeError(f"无效的速率: {rate}")
+    return group, qps
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="GCP 免费服务器多功能管理工具。不带子命令时进入交互菜单；带子命令时以批处理模式运行，结果以 JSON lines 输出到 stdout。",
+    )
+    parser.add_argument("--trace-chrome", metavar="FILE", help="退出时导出 Chrome trace JSON (chrome://tracing / Perfetto)")
+    parser.add_argument("--trace-prom", metavar="FILE", help="退出时导出 Prometheus textfile 指标")
+    parser.add_argument("--trace-summary", action="store_true", help="退出时按分类打印耗时统计")
+    parser.add_argument(
+        "--api-rate",
+        action="append",
+        default=[],
+        type=parse_api_rate,
+        metavar="GROUP=QPS",
+        help=f"调整某类 API 的每秒请求数，可重复，0 表示不限速 ({', '.join(f'{g}={r:g}' for g, r in API_RATE_LIMITS.items())})",
+    )
+    parser.add_argument("--api-retries", type=int, default=5, help="遇到 429/5xx 时的最大重试次数")
+    subparsers = parser.add_subparsers(dest="command")
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--project", help="项目 ID (默认读取 GOOGLE_CLOUD_PROJECT)")
+    common.add_argument("--instance", action="append", default=[], help="目标实例，可写为 NAME 或 ZONE/NAME，可重复")
+    common.add_argument("--zone", help="目标实例所在可用区")
+    common.add_argument("--parallel", type=int, default=1, help="并发处理的实例数量")
+    common.add_argument("--continue-on-error", action="store_true", help="某一步失败后继续执行后续步骤")
+    common.add_argument("--remote", choices=["gcloud", "ssh"], default="gcloud", help="远程执行方式")
+    common.add_argument("--ssh-user", help="SSH 用户名")
+    common.add_argument("--ssh-port", help="SSH 端口")
+    common.add_argument("--ssh-key", help="SSH 私钥路径")
+
+    subparsers.add_parser("list", parents=[common], help="列出实例")
+
+    p = subparsers.add_parser("create", parents=[common], help="新建免费实例")
+    p.add_argument("--region", choices=[r["region"] for r in REGION_OPTIONS], help="未指定 --zone 时使用该区域的默认可用区")
+    p.add_argument("--os", default=OS_IMAGE_OPTIONS[0]["family"], help=f"镜像 family，自制镜像族以 {BAKED_FAMILY_PREFIX} 开头")
+    p.add_argument("--provision", help=f"开机自动配置步骤，逗号分隔 ({','.join(PROVISION_STEPS)})")
+    p.add_argument("--wait-provision", action="store_true", help="等待开机配置完成")
+    p.add_argument("--provision-timeout", type=int, default=1200, help="等待开机配置的超时秒数")
+
+    p = subparsers.add_parser("reroll", parents=[common], help="刷 CPU")
+    p.add_argument("--cpu", default="AMD", help="目标 CPU 关键字")
+    p.add_argument("--max-attempts", type=int, help="最大尝试次数")
+
+    p = subparsers.add_parser("firewall", parents=[common], help="配置防火墙规则")
+    p.add_argument("--allow-ingress", action="store_true", help="添加允许所有入站连接规则")
+    p.add_argument("--deny-cdn", action="store_true", help="添加拒绝 CDN 出站规则")
+    p.add_argument("--cdn-file", default="cdnip.txt", help="CDN IP 列表文件")
+
+    subparsers.add_parser("apt", parents=[common], help="Debian 换源")
+    subparsers.add_parser("dae", parents=[common], help="安装 dae")
+    subparsers.add_parser("config", parents=[common], help="上传 config.dae 并启用 dae")
+
+    p = subparsers.add_parser("monitor", parents=[common], help="安装流量监控脚本")
+    p.add_argument("--script", choices=MONITOR_SCRIPTS, default="net_shutdown", help="流量监控脚本")
+
+    p = subparsers.add_parser("bake", parents=[common], help="将实例启动盘制作为自制镜像")
+    p.add_argument("--family", default=DEFAULT_BAKED_FAMILY, help="镜像族名称")
+    p.add_argument("--keep", type=int, default=2, help="镜像族中保留的镜像数量，0 表示不清理")
+
+    p = subparsers.add_parser("delete", parents=[common], help="删除免费资源")
+    p.add_argument("--yes", action="store_true", help="确认删除 (批处理模式必须指定)")
+
+    p = subparsers.add_parser("traffic", parents=[common], help="汇总实例的出站流量 (不指定 --instance 时为全部实例)")
+    p.add_argument("--limit", type=float, default=TRAFFIC_LIMIT_GB, help="每月出站流量上限 (GB)")
+    p.add_argument("--timeout", type=int, default=60, help="单台实例的采集超时秒数")
+    p.set_defaults(parallel=8)
+
+    p = subparsers.add_parser("plan", help="按计划文件批量执行")
+    p.add_argument("plan_file", help="JSON 计划文件路径")
+    p.add_argument("--project", help="覆盖计划文件中的项目 ID")
+    p.add_argument("--parallel", type=int, help="覆盖计划文件中的并发数量")
+    return parser
+
+
+def plan_from_args(args):
+    if args.command == "plan":
+        plan = load_plan_file(args.plan_file)
+        if args.project:
+            plan["project"] = args.project
+        if args.parallel:
+            plan["parallel"] = args.parallel
+        return plan
+
+    step = {"action": args.command}
+    if args.command == "create":
+        step.update(
+            region=args.region,
+            os=args.os,
+            provision=args.provision,
+            wait_provision=args.wait_provision,
+            provision_timeout=args.provision_timeout,
+        )
+    elif args.command == "reroll":
+        step.update(cpu=args.cpu, max_attempts=args.max_attempts)
+    elif args.command == "firewall":
+        step.update(allow_ingress=args.allow_ingress, deny_cdn=args.deny_cdn, cdn_file=args.cdn_file)
+    elif args.command == "monitor":
+        step.update(script=args.script)
+    elif args.command == "bake":
+        step.update(family=args.family, keep=args.keep)
+    elif args.command == "delete" and not args.yes:
+        raise BatchError("批处理模式下删除资源必须指定 --yes")
+
+    targets = [parse_target(value) for value in args.instance]
+    if args.zone:
+        for target in targets:
+            target["zone"] = target["zone"] or args.zone
+    if args.command == "create" and not targets:
+        targets = [{"name": "free-tier-vm", "zone": args.zone}]
+
+    return {
+        "project": args.project,
+        "targets": targets,
+        "steps": [step],
+        "parallel": args.parallel,
+        "continue_on_error": args.continue_on_error,
+        "remote": {
+            "method": args.remote,
+            "user": args.ssh_user,
+            "port": args.ssh_port,
+            "key": args.ssh_key,
+        },
+    }
+
+
+def run_traffic(args):
+    project_id = args.project or os.environ.get("GOOGLE_CLOUD_PROJECT")
+    if not project_id:
+        raise BatchError("未指定项目 ID (--project)")
+    remote_config = remote_config_from_options(
+        {"method": args.remote, "user": args.ssh_user, "port": args.ssh_port, "key": args.ssh_key}
+    )
+    if args.instance:
+        instances = []
+        for value in args.instance:
+            target = parse_target(value)
+            target["zone"] = target["zone"] or args.zone
+            instances.append(resolve_target(project_id, target))
+    else:
+        instances = list_instances(project_id)
+    if not instances:
+        raise BatchError("项目中没有任何实例")
+
+    rows = collect_fleet_traffic(project_id, instances, remote_config, args.parallel, args.limit, args.timeout)
+    for row in rows:
+        record = {"project": project_id, "target": row["name"], "zone": row["zone"], "action": "traffic", "ok": row["ok"]}
+        if row.get("error"):
+            record["error"] = row["error"]
+        record["result"] = {k: v for k, v in row.items() if k not in ("name", "zone", "ok", "error")}
+        emit_json(record)
+
+    known = [row for row in rows if "tx_gb" in row]
+    emit_json(
+        {
+            "project": project_id,
+            "action": "traffic_summary",
+            "ok": all(row["ok"] for row in rows),
+            "hosts": len(rows),
+            "collected": sum(1 for row in rows if row["ok"]),
+            "total_tx_gb": round(sum(row["tx_gb"] for row in known), 2),
+            "projected_total_gb": round(sum(row["projected_gb"] for row in known), 2),
+            "at_risk": [row["name"] for row in known if row["status"] == "at_risk"],
+            "over": [row["name"] for row in known if row["status"] == "over"],
+        }
+    )
+    return 0 if all(row["ok"] for row in rows) else 1
+
+
+def run_batch(args):
+    global JSON_STREAM
+    JSON_STREAM = sys.stdout
+    # 人类可读的提示全部转到 stderr
+    sys.stdout = sys.stderr
+    try:
+        if args.command == "list":
+            project_id = args.project or os.environ.get("GOOGLE_CLOUD_PROJECT")
+            if not project_id:
+                raise BatchError("未指定项目 ID (--project)")
+            for inst in list_instances(project_id):
+                emit_json(dict(inst, project=project_id, action="list"))
+            return 0
+        if args.command == "traffic":
+            return run_traffic(args)
+        return 0 if run_plan(plan_from_args(args)) else 1
+    except BatchError as e:
+        emit_json({"ok": False, "action": args.command, "error": str(e)})
+        return 2
+    except Exception as e:
+        # API 错误等未预期的异常也以 JSON 报告，保证 stdout 只有 JSON 且退出码非 0
+        traceback.print_exc()
+        emit_json({"ok": False, "action": args.command, "error": str(e)})
+        return 1
+    finally:
+        sys.stdout = JSON_STREAM
+
+
 def main():
     print("GCP 免费服务器多功能管理工具")
     project_id = select_gcp_project()
     current_instance = None
     remote_config = None
+    # 用户看菜单时在后台拉取实例列表、可用区和镜像，选择时直接使用
+    PREFETCHER.start()
+    prefetch_menu_data(project_id)
+    instances_key = ("instances", project_id)
 
     while True:
         print("\n================================================")
@@ -783,20 +2375,29 @@ def main():
         print("[7] 上传 config.dae 并启用 dae")
         print("[8] 安装流量监控脚本（仅适配 Debian）")
         print("[9] 删除当前免费资源")
+        print("[10] 将当前服务器制作为自制镜像")
+        print("[11] 查看所有服务器流量汇总")
         print("[0] 退出")
         choice = input("请输入数字选择: ").strip()
 
         if choice == "1":
             zone = select_zone(project_id)
-            os_config = select_os_image()
-            create_instance(project_id, zone, os_config)
+            os_config = select_os_image(project_id)
+            provision_steps = select_provision_steps()
+            created = create_instance(project_id, zone, os_config, provision_steps=provision_steps)
+            PREFETCHER.refresh(instances_key)
+            if created and (provision_steps or os_config.get("baked")):
+                wait_for_provision(project_id, zone, created["name"])
+                PREFETCHER.refresh(instances_key)
         elif choice == "2":
             current_instance = select_instance(project_id)
+            PREFETCHER.refresh(instances_key)
         elif choice == "3":
             if not current_instance:
                 current_instance = select_instance(project_id)
             if current_instance:
                 reroll_cpu_loop(project_id, current_instance)
+                PREFETCHER.refresh(instances_key)
         elif choice == "4":
             if not current_instance:
                 current_instance = select_instance(project_id)
@@ -843,6 +2444,26 @@ def main():
             if current_instance:
                 if delete_free_resources(project_id, current_instance):
                     current_instance = None
+                PREFETCHER.refresh(instances_key)
+        elif choice == "10":
+            if not current_instance:
+                current_instance = select_instance(project_id)
+            if current_instance:
+                family = input(f"请输入镜像族名称 (默认 {DEFAULT_BAKED_FAMILY}): ").strip() or DEFAULT_BAKED_FAMILY
+                baked = bake_image(project_id, current_instance, family)
+                if baked:
+                    prefetch_image({"project": project_id, "family": baked["family"]})
+                PREFETCHER.refresh(instances_key, ("baked_images", project_id))
+        elif choice == "11":
+            instances = PREFETCHER.get(instances_key, list_instances, project_id)
+            if not instances:
+                print_warning("该项目中没有任何实例！")
+                continue
+            if not remote_config:
+                remote_config = pick_remote_method()
+            if remote_config:
+                print_info(f"正在并发采集 {len(instances)} 台服务器的流量数据...")
+                print_traffic_report(collect_fleet_traffic(project_id, instances, remote_config))
         elif choice == "0":
             print("已退出。")
             break
@@ -851,10 +2472,24 @@ def main():
 
 
 if __name__ == "__main__":
+    cli_args = build_arg_parser().parse_args()
+    if cli_args.trace_chrome or cli_args.trace_prom or cli_args.trace_summary:
+        TRACER.enable()
+    SCHEDULER.configure(dict(cli_args.api_rate), cli_args.api_retries)
+    exit_code = 0
     try:
-        main()
+        if cli_args.command:
+            exit_code = run_batch(cli_args)
+        else:
+            main()
     except KeyboardInterrupt:
-        print("\n[用户终止] 脚本已停止。")
+        print("\n[用户终止] 脚本已停止。", file=sys.stderr)
+        exit_code = 130
     except Exception as e:
-        print(f"\n[错误] 发生异常: {e}")
+        print(f"\n[错误] 发生异常: {e}", file=sys.stderr)
         traceback.print_exc()
+        exit_code = 1
+    finally:
+        PREFETCHER.shutdown()
+        finish_tracing(cli_args)
+    sys.exit(exit_code)
@@ -0,0 +1,327 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import gcp_fake
+
+gcp_fake.install()
+import gcp  # noqa: E402  必须在 install() 之后导入
+
+PROJECT_ID = "fake-project"
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def new_cloud(args, scale, **overrides):
+    options = {
+        "latency": args.latency,
+        "boot_seconds": args.boot_seconds,
+        "seed": args.seed,
+        "error_rate": args.error_rate,
+    }
+    if args.amd_ratio is not None:
+        options["cpu_platforms"] = [("AMD Milan", args.amd_ratio), ("Intel Broadwell", 1 - args.amd_ratio)]
+    options.update(overrides)
+    cloud = gcp_fake.FakeCloud(gcp_fake.SimClock(args.scale or scale), **options)
+    return gcp_fake.use_cloud(cloud, gcp)
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def bench_reroll(args):
+    attempts = []
+    durations = []
+    for run in range(args.reroll_runs):
+        cloud = new_cloud(args, 0.002, seed=None if args.seed is None else args.seed + run)
+        cloud.add_instance(PROJECT_ID, "us-west1-b", "bench-vm", cpu_platform="Intel Broadwell")
+        inst = {"name": "bench-vm", "zone": "us-west1-b"}
+        start = cloud.clock.now()
+        with quiet(not args.verbose):
+            result = gcp.reroll_cpu_loop(PROJECT_ID, inst, max_attempts=args.max_attempts)
+        durations.append(cloud.clock.now() - start)
+        attempts.append(result["attempts"])
+    total = sum(durations)
+    return [
+        ("reroll.attempts_per_hour", sum(attempts) / total * 3600, "attempts/h"),
+        ("reroll.seconds_per_attempt", total / sum(attempts), "s"),
+        ("reroll.time_to_target_p50", statistics.median(durations), "s"),
+        ("reroll.time_to_target_max", max(durations), "s"),
+    ]
+
+
+def bench_list(args):
+    cloud = new_cloud(args, 1.0)
+    zones = [zone for names in cloud.zones.values() for zone in names]
+    for i in range(args.instances):
+        cloud.add_instance(PROJECT_ID, zones[i % len(zones)], f"vm-{i:05d}", cpu_platform="AMD Milan")
+    latencies = []
+    for _ in range(args.list_runs):
+        start = cloud.clock.now()
+        with quiet(not args.verbose):
+            found = gcp.list_instances(PROJECT_ID)
+        latencies.append(cloud.clock.now() - start)
+        assert len(found) == args.instances, f"expected {args.instances}, got {len(found)}"
+    return [
+        (f"list.latency_p50@{args.instances}", statistics.median(latencies), "s"),
+        (f"list.latency_max@{args.instances}", max(latencies), "s"),
+    ]
+
+
+def bench_teardown(args):
+    durations = []
+    for run in range(args.teardown_runs):
+        cloud = new_cloud(args, 0.005)
+        cloud.add_instance(PROJECT_ID, "us-west1-b", "bench-vm", cpu_platform="AMD Milan")
+        for rule_name in gcp.FIREWALL_RULES_TO_CLEAN:
+            cloud.firewalls[(PROJECT_ID, rule_name)] = gcp_fake.Firewall(name=rule_name)
+        inst = {"name": "bench-vm", "zone": "us-west1-b"}
+        start = cloud.clock.now()
+        with quiet(not args.verbose):
+            ok = gcp.delete_free_resources(PROJECT_ID, inst, confirm=False)
+        durations.append(cloud.clock.now() - start)
+        assert ok and not cloud.instances and not cloud.firewalls
+    return [
+        ("teardown.seconds_p50", statistics.median(durations), "s"),
+        ("teardown.seconds_max", max(durations), "s"),
+    ]
+
+
+def bench_firewall(args):
+    with quiet():
+        ips = gcp.read_cdn_ips_for_rule(os.path.join(SCRIPT_DIR, "cdnip.txt"))
+    network = "global/networks/default"
+    durations = []
+    for run in range(args.firewall_runs):
+        cloud = new_cloud(args, 0.005)
+        start = cloud.clock.now()
+        with quiet(not args.verbose):
+            ok = gcp.add_allow_all_ingress(PROJECT_ID, network) and gcp.add_deny_cdn_egress(PROJECT_ID, ips, network)
+        durations.append(cloud.clock.now() - start)
+        assert ok
+    return [
+        ("firewall.seconds_p50", statistics.median(durations), "s"),
+        ("firewall.seconds_max", max(durations), "s"),
+    ]
+
+
+def bench_create(args):
+    os_config = gcp.OS_IMAGE_OPTIONS[0]
+    steps = ["apt", "dae", "config", "net_shutdown"]
+    durations = []
+    for run in range(args.create_runs):
+        cloud = new_cloud(args, 0.005)
+        start = cloud.clock.now()
+        with quiet(not args.verbose):
+            created = gcp.create_instance(PROJECT_ID, "us-west1-b", os_config, instance_name="bench-vm", provision_steps=steps)
+            provision = gcp.wait_for_provision(PROJECT_ID, "us-west1-b", "bench-vm", interval=5)
+        durations.append(cloud.clock.now() - start)
+        assert created and provision["status"] == "done", provision
+    return [
+        ("create.seconds_to_serving_p50", statistics.median(durations), "s"),
+        ("create.seconds_to_serving_max", max(durations), "s"),
+    ]
+
+
+def bench_rebuild(args):
+    os_config = gcp.OS_IMAGE_OPTIONS[0]
+    steps = ["apt", "dae", "config", "net_shutdown"]
+    durations = []
+    bake_durations = []
+    for run in range(args.rebuild_runs):
+        cloud = new_cloud(args, 0.005)
+        inst = {"name": "bench-vm", "zone": "us-west1-b"}
+        with quiet(not args.verbose):
+            gcp.create_instance(PROJECT_ID, "us-west1-b", os_config, instance_name="bench-vm", provision_steps=steps)
+            gcp.wait_for_provision(PROJECT_ID, "us-west1-b", "bench-vm", interval=5)
+            start = cloud.clock.now()
+            baked = gcp.bake_image(PROJECT_ID, inst, keep=0)
+            bake_durations.append(cloud.clock.now() - start)
+            gcp.delete_free_resources(PROJECT_ID, inst, confirm=False)
+
+            # 自制镜像已包含全部配置，重建时只重新下发 config.dae
+            baked_config = gcp.find_os_config(baked["family"], PROJECT_ID)
+            start = cloud.clock.now()
+            created = gcp.create_instance(PROJECT_ID, "us-west1-b", baked_config, instance_name="bench-vm", provision_steps=["config"])
+            provision = gcp.wait_for_provision(PROJECT_ID, "us-west1-b", "bench-vm", interval=5)
+        durations.append(cloud.clock.now() - start)
+        assert created and provision["status"] == "done", provision
+        assert cloud.instances[(PROJECT_ID, "us-west1-b", "bench-vm")]["provision_steps"] == ["config"]
+    return [
+        ("rebuild.bake_seconds_p50", statistics.median(bake_durations), "s"),
+        ("rebuild.seconds_to_serving_p50", statistics.median(durations), "s"),
+        ("rebuild.seconds_to_serving_max", max(durations), "s"),
+    ]
+
+
+def menu_fetches(os_config):
+    # 与菜单中 [2] 选择服务器、[1] 新建实例依次用到的数据相同
+    gcp.PREFETCHER.get(("instances", PROJECT_ID), gcp.list_instances, PROJECT_ID)
+    gcp.PREFETCHER.get(("zones", PROJECT_ID), gcp.list_zones_by_region, PROJECT_ID)
+    gcp.PREFETCHER.get(("baked_images", PROJECT_ID), gcp.list_baked_image_options, PROJECT_ID)
+    gcp.PREFETCHER.get(
+        ("image", os_config["project"], os_config["family"]),
+        gcp.get_image_from_family,
+        os_config["project"],
+        os_config["family"],
+    )
+
+
+def bench_menu(args):
+    os_config = gcp.OS_IMAGE_OPTIONS[0]
+    cold = []
+    warm = []
+    for run in range(args.menu_runs):
+        for prefetch, latencies in ((False, cold), (True, warm)):
+            cloud = new_cloud(args, 0.01)
+            zones = [zone for names in cloud.zones.values() for zone in names]
+            for i in range(args.menu_instances):
+                cloud.add_instance(PROJECT_ID, zones[i % len(zones)], f"vm-{i:03d}", cpu_platform="AMD Milan")
+            gcp.PREFETCHER = gcp.Prefetcher()
+            if prefetch:
+                gcp.PREFETCHER.start()
+                gcp.prefetch_menu_data(PROJECT_ID)
+            # 模拟用户阅读菜单的时间
+            cloud.clock.sleep(args.think_seconds)
+            start = cloud.clock.now()
+            with quiet(not args.verbose):
+                menu_fetches(os_config)
+            latencies.append(cloud.clock.now() - start)
+            gcp.PREFETCHER.shutdown()
+    gcp.PREFETCHER = gcp.Prefetcher()
+    return [
+        ("menu.wait_seconds_cold_p50", statistics.median(cold), "s"),
+        ("menu.wait_seconds_prefetched_p50", statistics.median(warm), "s"),
+        ("menu.wait_seconds_prefetched_max", max(warm), "s"),
+    ]
+
+
+def bench_burst(args):
+    # 多线程并发读取，对比不限速/不重试与经过调度器时的失败数和吞吐
+    results = {}
+    for label, rates, retries in (
+        ("raw", {group: 0 for group in gcp.API_RATE_LIMITS}, 0),
+        ("scheduled", {"read": args.quota_qps * 0.8}, args.api_retries),
+    ):
+        cloud = new_cloud(args, 0.01, rate_limit=args.quota_qps)
+        cloud.add_instance(PROJECT_ID, "us-west1-b", "bench-vm", cpu_platform="AMD Milan")
+        gcp.SCHEDULER = gcp.ApiScheduler(rates, retries)
+
+        def read(_):
+            try:
+                gcp.compute_client("InstancesClient").get(project=PROJECT_ID, zone="us-west1-b", instance="bench-vm")
+                return True
+            except Exception:
+                return False
+
+        start = cloud.clock.now()
+        with ThreadPoolExecutor(max_workers=args.burst_threads) as pool:
+            ok = sum(pool.map(read, range(args.burst_calls)))
+        elapsed = cloud.clock.now() - start
+        stats = gcp.SCHEDULER.stats.get("read", {})
+        results[label] = {
+            "failed": args.burst_calls - ok,
+            "throughput": ok / elapsed if elapsed else 0.0,
+            "retries": sum(stats.get("retries", {}).values()),
+            "queue_depth_max": stats.get("queue_depth_max", 0),
+        }
+    gcp.SCHEDULER = gcp.ApiScheduler()
+    return [
+        ("burst.failed_raw", results["raw"]["failed"], "calls"),
+        ("burst.failed_scheduled", results["scheduled"]["failed"], "calls"),
+        ("burst.throughput_scheduled", results["scheduled"]["throughput"], "calls/s"),
+        ("burst.retries_scheduled", results["scheduled"]["retries"], "calls"),
+        ("burst.queue_depth_max", results["scheduled"]["queue_depth_max"], "calls"),
+    ]
+
+
+BENCHMARKS = {
+    "reroll": bench_reroll,
+    "list": bench_list,
+    "teardown": bench_teardown,
+    "firewall": bench_firewall,
+    "create": bench_create,
+    "rebuild": bench_rebuild,
+    "menu": bench_menu,
+    "burst": bench_burst,
+}
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="在内存模拟的 Compute API 上测量 gcp.py 热点路径的耗时（模拟秒）。",
+    )
+    parser.add_argument("benchmarks", nargs="*", help=f"要运行的测试 ({', '.join(BENCHMARKS)})，默认全部")
+    parser.add_argument("--scale", type=float, help="模拟 1 秒对应的真实秒数，默认每个测试自行选择")
+    parser.add_argument("--latency", type=float, default=0.15, help="单次 API 调用延迟 (模拟秒)")
+    parser.add_argument("--boot-seconds", type=float, default=20.0, help="启动后 CPU 信息可见前的时间 (模拟秒)")
+    parser.add_argument("--amd-ratio", type=float, help="分配到 AMD CPU 的概率，默认使用内置分布")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="每次 API 调用随机返回 429/503 的概率")
+    parser.add_argument("--instances", type=int, default=1000, help="list 测试的实例数量")
+    parser.add_argument("--reroll-runs", type=int, default=20)
+    parser.add_argument("--max-attempts", type=int, default=50)
+    parser.add_argument("--list-runs", type=int, default=5)
+    parser.add_argument("--teardown-runs", type=int, default=5)
+    parser.add_argument("--firewall-runs", type=int, default=5)
+    parser.add_argument("--create-runs", type=int, default=5)
+    parser.add_argument("--rebuild-runs", type=int, default=3)
+    parser.add_argument("--menu-runs", type=int, default=5)
+    parser.add_argument("--menu-instances", type=int, default=20, help="menu 测试的实例数量")
+    parser.add_argument("--think-seconds", type=float, default=3.0, help="menu 测试中用户阅读菜单的时间 (模拟秒)")
+    parser.add_argument("--burst-calls", type=int, default=300, help="burst 测试的并发读取次数")
+    parser.add_argument("--burst-threads", type=int, default=32)
+    parser.add_argument("--quota-qps", type=float, default=20.0, help="burst 测试中模拟 API 每秒允许的调用数，超出返回 429")
+    parser.add_argument("--api-retries", type=int, default=5, help="burst 测试中调度器的最大重试次数")
+    parser.add_argument("--json", action="store_true", help="以 JSON lines 输出结果")
+    parser.add_argument("--trace-summary", action="store_true", help="结束时打印 gcp.py 的分类耗时统计")
+    parser.add_argument("-v", "--verbose", action="store_true", help="显示 gcp.py 的输出")
+    return parser
+
+
+def main(argv=None):
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    names = args.benchmarks or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error(f"未知的测试: {name}")
+    if args.trace_summary:
+        gcp.TRACER.enable()
+
+    results = []
+    for name in names:
+        started = time.time()
+        for metric, value, unit in BENCHMARKS[name](args):
+            results.append({"benchmark": name, "metric": metric, "value": round(value, 3), "unit": unit})
+        if not args.json:
+            print(f"[{name}] 完成，真实耗时 {time.time() - started:.1f}s", file=sys.stderr)
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result, ensure_ascii=False))
+    else:
+        print(f"\n{'指标':<32} {'数值':>12}  单位")
+        for result in results:
+            print(f"{result['metric']:<34} {result['value']:>12.3f}  {result['unit']}")
+
+    if args.trace_summary:
+        # 每个测试都有独立的模拟时钟，这里以已追踪耗时之和作为总耗时
+        traced = sum(span["duration"] for span in gcp.TRACER.spans)
+        gcp.TRACER.print_summary(wall=traced)
+        gcp.SCHEDULER.print_summary()
+
+
+if __name__ == "__main__":
+    main()
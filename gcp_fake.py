@@ -0,0 +1,710 @@
+# gcp.py 用到的 Compute / ResourceManager 接口的内存模拟实现。
+# 用法：在 import gcp 之前调用 install()，之后 gcp.py 里的
+# compute_v1 / resourcemanager_v3 都会指向这里的模拟对象。
+# 所有延迟都按 SimClock 的模拟秒计算，scale 越小跑得越快。
+
+import collections
+import itertools
+import random
+import sys
+import threading
+import time
+import types
+
+DEFAULT_ZONES = {
+    "us-west1": ["us-west1-a", "us-west1-b", "us-west1-c"],
+    "us-central1": ["us-central1-a", "us-central1-b", "us-central1-c", "us-central1-f"],
+    "us-east1": ["us-east1-b", "us-east1-c", "us-east1-d"],
+}
+
+DEFAULT_CPU_PLATFORMS = [
+    ("Intel Broadwell", 0.45),
+    ("Intel Skylake", 0.25),
+    ("AMD Rome", 0.2),
+    ("AMD Milan", 0.1),
+]
+
+DEFAULT_OPERATION_SECONDS = {
+    "insert": 15.0,
+    "start": 10.0,
+    "stop": 25.0,
+    "delete": 30.0,
+    "firewall": 8.0,
+    "disk_delete": 5.0,
+    "image": 180.0,
+    "image_delete": 10.0,
+    "metadata": 3.0,
+}
+
+# startup-script 中每个配置步骤的耗时
+DEFAULT_PROVISION_SECONDS = {
+    "apt": 60.0,
+    "dae": 90.0,
+    "config": 5.0,
+    "net_iptables": 45.0,
+    "net_shutdown": 45.0,
+}
+
+# 真实的 operations.wait 最多阻塞 2 分钟
+OPERATION_WAIT_LIMIT = 120.0
+
+
+class SimClock:
+    def __init__(self, scale=0.01):
+        self.scale = scale
+        self.origin = time.monotonic()
+
+    def now(self):
+        return (time.monotonic() - self.origin) / self.scale
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds * self.scale)
+
+    def time_module(self):
+        # 替换 gcp.time，让 gcp.py 里的 sleep 和耗时统计都使用模拟秒，其余函数沿用 time 模块
+        module = types.ModuleType("time")
+        module.__dict__.update(time.__dict__)
+        module.sleep = self.sleep
+        module.time = self.now
+        module.monotonic = self.now
+        return module
+
+
+class FakeApiError(Exception):
+    code = 500
+
+    def __init__(self, message, code=None):
+        if code is not None:
+            self.code = code
+        super().__init__(f"{self.code} {message}")
+
+
+class NotFound(FakeApiError):
+    code = 404
+
+
+class Conflict(FakeApiError):
+    code = 409
+
+
+class TooManyRequests(FakeApiError):
+    code = 429
+
+
+class Message:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return None
+
+
+class _Enum:
+    def __init__(self, *names):
+        for name in names:
+            setattr(self, name, types.SimpleNamespace(name=name))
+
+
+class FakeCloud:
+    def __init__(
+        self,
+        clock,
+        latency=0.15,
+        latency_jitter=0.05,
+        operation_seconds=None,
+        boot_seconds=20.0,
+        boot_jitter=5.0,
+        cpu_platforms=None,
+        page_size=500,
+        per_item_seconds=0.0004,
+        zones=None,
+        projects=("fake-project",),
+        provision_seconds=None,
+        error_rate=0.0,
+        error_codes=(503, 429),
+        rate_limit=None,
+        seed=None,
+    ):
+        self.clock = clock
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.operation_seconds = dict(DEFAULT_OPERATION_SECONDS, **(operation_seconds or {}))
+        self.boot_seconds = boot_seconds
+        self.boot_jitter = boot_jitter
+        self.cpu_platforms = cpu_platforms or DEFAULT_CPU_PLATFORMS
+        self.page_size = page_size
+        self.per_item_seconds = per_item_seconds
+        self.zones = zones or DEFAULT_ZONES
+        self.projects = list(projects)
+        self.provision_seconds = dict(DEFAULT_PROVISION_SECONDS, **(provision_seconds or {}))
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.instances = {}
+        self.disks = set()
+        self.firewalls = {}
+        self.images = {}
+        self.operations = {}
+        self.op_counter = itertools.count(1)
+        self.ip_counter = itertools.count(2)
+        self.call_counts = {}
+        # 故障注入：error_rate 为每次调用随机失败的概率；rate_limit 为每模拟秒允许的调用数，超出返回 429
+        self.error_rate = error_rate
+        self.error_codes = list(error_codes)
+        self.rate_limit = rate_limit
+        self.recent_calls = collections.deque()
+        self.error_counts = {}
+
+    # ---------- 基础设施 ----------
+
+    def api_call(self, name, extra_seconds=0.0):
+        with self.lock:
+            self.call_counts[name] = self.call_counts.get(name, 0) + 1
+            jitter = self.random.uniform(-self.latency_jitter, self.latency_jitter)
+            error = self.injected_error(name)
+        if error is not None:
+            self.clock.sleep(max(0.0, self.latency + jitter))
+            raise error
+        self.clock.sleep(max(0.0, self.latency + jitter) + extra_seconds)
+
+    def injected_error(self, name):
+        error = None
+        if self.rate_limit:
+            now = self.clock.now()
+            while self.recent_calls and self.recent_calls[0] <= now - 1.0:
+                self.recent_calls.popleft()
+            if len(self.recent_calls) >= self.rate_limit:
+                error = TooManyRequests(f"Quota exceeded for quota metric 'Queries' while calling {name}")
+            else:
+                self.recent_calls.append(now)
+        if error is None and self.error_rate and self.random.random() < self.error_rate:
+            code = self.random.choice(self.error_codes)
+            error = FakeApiError(f"Injected failure while calling {name}", code=code)
+        if error is not None:
+            self.error_counts[error.code] = self.error_counts.get(error.code, 0) + 1
+        return error
+
+    def pick_cpu_platform(self):
+        names = [name for name, _ in self.cpu_platforms]
+        weights = [weight for _, weight in self.cpu_platforms]
+        with self.lock:
+            return self.random.choices(names, weights)[0]
+
+    def new_operation(self, kind, zone=None):
+        seconds = self.operation_seconds[kind]
+        with self.lock:
+            name = f"operation-{next(self.op_counter)}-{kind}"
+            self.operations[name] = {"done_at": self.clock.now() + seconds, "zone": zone}
+        return Message(name=name, error=None, status="RUNNING")
+
+    def wait_operation(self, name):
+        op = self.operations.get(name)
+        if op is None:
+            raise NotFound(f"The resource 'operations/{name}' was not found")
+        remaining = op["done_at"] - self.clock.now()
+        self.clock.sleep(min(max(remaining, 0.0), OPERATION_WAIT_LIMIT))
+        status = "DONE" if self.clock.now() >= op["done_at"] else "RUNNING"
+        return Message(name=name, error=None, status=status)
+
+    # ---------- 实例 ----------
+
+    def add_instance(self, project, zone, name, status="RUNNING", cpu_platform=None, network="global/networks/default"):
+        now = self.clock.now()
+        with self.lock:
+            index = next(self.ip_counter)
+            self.instances[(project, zone, name)] = {
+                "name": name,
+                "zone": zone,
+                "status": status,
+                "transition_at": now,
+                "next_status": status,
+                "cpu_platform": cpu_platform or "",
+                "platform_at": now,
+                "network": f"https://www.googleapis.com/compute/v1/projects/{project}/{network}",
+                "internal_ip": f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}",
+                "external_ip": f"34.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}",
+                "disks": [name],
+                "metadata": {},
+                "metadata_fingerprint": 0,
+            }
+            self.disks.add((project, zone, name))
+
+    def get_record(self, project, zone, name):
+        record = self.instances.get((project, zone, name))
+        if record is None:
+            raise NotFound(f"The resource 'projects/{project}/zones/{zone}/instances/{name}' was not found")
+        now = self.clock.now()
+        if now >= record["transition_at"]:
+            record["status"] = record["next_status"]
+        return record
+
+    def instance_message(self, project, record):
+        now = self.clock.now()
+        running = record["status"] == "RUNNING"
+        cpu_platform = record["cpu_platform"] if running and now >= record["platform_at"] else "Unknown CPU Platform"
+        return Message(
+            name=record["name"],
+            zone=f"https://www.googleapis.com/compute/v1/projects/{project}/zones/{record['zone']}",
+            status=record["status"],
+            cpu_platform=cpu_platform,
+            network_interfaces=[
+                Message(
+                    network=record["network"],
+                    network_i_p=record["internal_ip"],
+                    access_configs=[Message(nat_i_p=record["external_ip"] if running else None)],
+                )
+            ],
+            disks=[
+                Message(
+                    boot=True,
+                    source=f"https://www.googleapis.com/compute/v1/projects/{project}/zones/{record['zone']}/disks/{d}",
+                )
+                for d in record["disks"]
+            ],
+            metadata=Message(
+                fingerprint=str(record["metadata_fingerprint"]),
+                items=[Message(key=k, value=v) for k, v in record["metadata"].items()],
+            ),
+        )
+
+    def start_provisioning(self, record, source_image):
+        # 按 gcp.py 生成的 startup-script 中的 STEPS 推算配置进度
+        script = record["metadata"].get("startup-script") or ""
+        steps = []
+        for line in script.splitlines():
+            if line.startswith("STEPS="):
+                steps = line.split("=", 1)[1].strip('"').split()
+        image = self.images.get(source_image.rsplit("/", 1)[-1]) if source_image else None
+        # 从自制镜像启动时 startup-script 会清掉来源实例的步骤记录，本次指定的步骤照常执行；
+        # 不指定步骤时直接上报完成
+        record["provision_steps"] = steps
+        record["provisioned"] = bool(image and image["provisioned"])
+
+    def provision_state(self, record):
+        if "startup-script" not in record["metadata"]:
+            return None
+        elapsed = self.clock.now() - record["platform_at"]
+        if record["status"] != "RUNNING" or elapsed < 0:
+            return None
+        steps = record.get("provision_steps", [])
+        for step in steps:
+            elapsed -= self.provision_seconds.get(step, 0.0)
+            if elapsed < 0:
+                return {"status": "running", "step": step}
+        record["provisioned"] = True
+        return {"status": "done", "step": steps[-1] if steps else ""}
+
+    def transition(self, record, status, next_status, seconds):
+        record["status"] = status
+        record["next_status"] = next_status
+        record["transition_at"] = self.clock.now() + seconds
+
+    def boot(self, record, op_seconds):
+        boot = max(0.0, self.boot_seconds + self.random.uniform(-self.boot_jitter, self.boot_jitter))
+        record["cpu_platform"] = self.pick_cpu_platform()
+        record["platform_at"] = self.clock.now() + op_seconds + boot
+
+
+CLOUD = None
+
+
+def _cloud():
+    if CLOUD is None:
+        raise RuntimeError("gcp_fake: 请先调用 use_cloud() 设置模拟环境")
+    return CLOUD
+
+
+# ---------- compute_v1 ----------
+
+
+class InstancesClient:
+    def get(self, project, zone, instance):
+        cloud = _cloud()
+        cloud.api_call("instances.get")
+        with cloud.lock:
+            return cloud.instance_message(project, cloud.get_record(project, zone, instance))
+
+    def insert(self, project, zone, instance_resource):
+        cloud = _cloud()
+        cloud.api_call("instances.insert")
+        name = instance_resource.name
+        if (project, zone, name) in cloud.instances:
+            raise Conflict(f"The resource 'projects/{project}/zones/{zone}/instances/{name}' already exists")
+        op = cloud.new_operation("insert", zone)
+        cloud.add_instance(project, zone, name, status="PROVISIONING")
+        items = getattr(instance_resource.metadata, "items", None) or []
+        with cloud.lock:
+            record = cloud.instances[(project, zone, name)]
+            record["metadata"] = {item.key: item.value for item in items}
+            seconds = cloud.operation_seconds["insert"]
+            cloud.transition(record, "PROVISIONING", "RUNNING", seconds)
+            cloud.boot(record, seconds)
+            disks = instance_resource.disks or []
+            params = disks[0].initialize_params if disks else None
+            cloud.start_provisioning(record, params.source_image if params else None)
+        return op
+
+    def start(self, project, zone, instance):
+        cloud = _cloud()
+        cloud.api_call("instances.start")
+        with cloud.lock:
+            record = cloud.get_record(project, zone, instance)
+        op = cloud.new_operation("start", zone)
+        with cloud.lock:
+            seconds = cloud.operation_seconds["start"]
+            if record["status"] != "RUNNING":
+                cloud.transition(record, "STAGING", "RUNNING", seconds)
+                cloud.boot(record, seconds)
+        return op
+
+    def stop(self, project, zone, instance):
+        cloud = _cloud()
+        cloud.api_call("instances.stop")
+        with cloud.lock:
+            record = cloud.get_record(project, zone, instance)
+        op = cloud.new_operation("stop", zone)
+        with cloud.lock:
+            cloud.transition(record, "STOPPING", "TERMINATED", cloud.operation_seconds["stop"])
+        return op
+
+    def delete(self, project, zone, instance):
+        cloud = _cloud()
+        cloud.api_call("instances.delete")
+        with cloud.lock:
+            record = cloud.get_record(project, zone, instance)
+            del cloud.instances[(project, zone, instance)]
+            # 启动盘随实例自动删除
+            for disk in record["disks"]:
+                cloud.disks.discard((project, zone, disk))
+        return cloud.new_operation("delete", zone)
+
+    def aggregated_list(self, request):
+        cloud = _cloud()
+        project = request.project
+        with cloud.lock:
+            records = sorted(
+                ((zone, name) for (p, zone, name) in cloud.instances if p == project),
+            )
+        if not records:
+            cloud.api_call("instances.aggregatedList")
+            return
+        for page_start in range(0, len(records), cloud.page_size):
+            page = records[page_start:page_start + cloud.page_size]
+            cloud.api_call("instances.aggregatedList", cloud.per_item_seconds * len(page))
+            by_zone = {}
+            with cloud.lock:
+                for zone, name in page:
+                    record = cloud.instances.get((project, zone, name))
+                    if record is None:
+                        continue
+                    cloud.get_record(project, zone, name)
+                    by_zone.setdefault(zone, []).append(cloud.instance_message(project, record))
+            for zone, instances in by_zone.items():
+                yield f"zones/{zone}", Message(instances=instances)
+
+
+    def set_metadata(self, project, zone, instance, metadata_resource):
+        cloud = _cloud()
+        cloud.api_call("instances.setMetadata")
+        with cloud.lock:
+            record = cloud.get_record(project, zone, instance)
+            if metadata_resource.fingerprint != str(record["metadata_fingerprint"]):
+                raise FakeApiError("Supplied fingerprint does not match current metadata fingerprint.", code=412)
+            record["metadata"] = {item.key: item.value for item in metadata_resource.items or []}
+            record["metadata_fingerprint"] += 1
+        return cloud.new_operation("metadata", zone)
+
+    def get_guest_attributes(self, project, zone, instance, query_path=None):
+        cloud = _cloud()
+        cloud.api_call("instances.getGuestAttributes")
+        with cloud.lock:
+            record = cloud.get_record(project, zone, instance)
+            state = cloud.provision_state(record)
+        if not state:
+            raise NotFound(f"The resource 'guestAttributes/{query_path}' was not found")
+        return Message(query_value=Message(items=[Message(key=k, value=v) for k, v in state.items()]))
+
+    def get_serial_port_output(self, project, zone, instance, port=1, start=0):
+        cloud = _cloud()
+        cloud.api_call("instances.getSerialPortOutput")
+        with cloud.lock:
+            record = cloud.get_record(project, zone, instance)
+            state = cloud.provision_state(record) or {}
+        contents = "".join(f"startup-script: gcp-free-provision: {k}={v}\n" for k, v in state.items())
+        return Message(contents=contents, next_=start + len(contents))
+
+
+class ZoneOperationsClient:
+    def wait(self, project, zone, operation):
+        cloud = _cloud()
+        cloud.api_call("zoneOperations.wait")
+        return cloud.wait_operation(operation)
+
+
+class GlobalOperationsClient:
+    def wait(self, project, operation):
+        cloud = _cloud()
+        cloud.api_call("globalOperations.wait")
+        return cloud.wait_operation(operation)
+
+
+class ZonesClient:
+    def list(self, project):
+        cloud = _cloud()
+        cloud.api_call("zones.list")
+        zones = []
+        for region, names in cloud.zones.items():
+            for name in names:
+                zones.append(
+                    Message(
+                        name=name,
+                        status="UP",
+                        region=f"https://www.googleapis.com/compute/v1/projects/{project}/regions/{region}",
+                    )
+                )
+        return zones
+
+
+class ImagesClient:
+    def get_from_family(self, project, family):
+        cloud = _cloud()
+        cloud.api_call("images.getFromFamily")
+        with cloud.lock:
+            baked = [
+                image for image in cloud.images.values()
+                if image["project"] == project and image["family"] == family
+            ]
+        if baked:
+            latest = max(baked, key=lambda image: image["created_at"])
+            return Message(name=latest["name"], family=family, self_link=latest["self_link"])
+        return Message(
+            name=f"{family}-v20240101",
+            family=family,
+            self_link=f"https://www.googleapis.com/compute/v1/projects/{project}/global/images/{family}-v20240101",
+        )
+
+    def list(self, project):
+        cloud = _cloud()
+        cloud.api_call("images.list")
+        with cloud.lock:
+            return [
+                Message(
+                    name=image["name"],
+                    family=image["family"],
+                    self_link=image["self_link"],
+                    creation_timestamp=f"{image['created_at']:020.6f}",
+                    deprecated=None,
+                )
+                for image in cloud.images.values()
+                if image["project"] == project
+            ]
+
+    def insert(self, request=None, project=None, image_resource=None):
+        cloud = _cloud()
+        cloud.api_call("images.insert")
+        force_create = False
+        if request is not None:
+            project, image_resource, force_create = request.project, request.image_resource, bool(request.force_create)
+        name = image_resource.name
+        zone, disk = image_resource.source_disk.split("/zones/", 1)[1].split("/disks/")
+        with cloud.lock:
+            if name in cloud.images:
+                raise Conflict(f"The resource 'projects/{project}/global/images/{name}' already exists")
+            if (project, zone, disk) not in cloud.disks:
+                raise NotFound(f"The resource 'projects/{project}/zones/{zone}/disks/{disk}' was not found")
+            source = next(
+                (r for (p, z, _), r in cloud.instances.items() if p == project and z == zone and disk in r["disks"]),
+                None,
+            )
+            # 与真实 API 一致：源磁盘挂在运行中的实例上时必须指定 force_create
+            if source and source["status"] == "RUNNING" and not force_create:
+                raise FakeApiError(f"The disk resource '{disk}' is already being used by '{source['name']}'", code=400)
+            cloud.images[name] = {
+                "name": name,
+                "project": project,
+                "family": image_resource.family,
+                "created_at": cloud.clock.now(),
+                "provisioned": bool(source and source.get("provisioned")),
+                "self_link": f"https://www.googleapis.com/compute/v1/projects/{project}/global/images/{name}",
+            }
+        return cloud.new_operation("image")
+
+    def delete(self, project, image):
+        cloud = _cloud()
+        cloud.api_call("images.delete")
+        with cloud.lock:
+            if cloud.images.pop(image, None) is None:
+                raise NotFound(f"The resource 'projects/{project}/global/images/{image}' was not found")
+        return cloud.new_operation("image_delete")
+
+
+class FirewallsClient:
+    def insert(self, project, firewall_resource):
+        cloud = _cloud()
+        cloud.api_call("firewalls.insert")
+        key = (project, firewall_resource.name)
+        with cloud.lock:
+            if key in cloud.firewalls:
+                raise Conflict(f"The resource 'projects/{project}/global/firewalls/{key[1]}' already exists")
+            cloud.firewalls[key] = firewall_resource
+        return cloud.new_operation("firewall")
+
+    def delete(self, project, firewall):
+        cloud = _cloud()
+        cloud.api_call("firewalls.delete")
+        with cloud.lock:
+            if cloud.firewalls.pop((project, firewall), None) is None:
+                raise NotFound(f"The resource 'projects/{project}/global/firewalls/{firewall}' was not found")
+        return cloud.new_operation("firewall")
+
+
+class DisksClient:
+    def delete(self, project, zone, disk):
+        cloud = _cloud()
+        cloud.api_call("disks.delete")
+        with cloud.lock:
+            if (project, zone, disk) not in cloud.disks:
+                raise NotFound(f"The resource 'projects/{project}/zones/{zone}/disks/{disk}' was not found")
+            cloud.disks.discard((project, zone, disk))
+        return cloud.new_operation("disk_delete", zone)
+
+
+class AccessConfig(Message):
+    Type = _Enum("ONE_TO_ONE_NAT")
+    NetworkTier = _Enum("STANDARD", "PREMIUM")
+
+
+class AttachedDisk(Message):
+    pass
+
+
+class AttachedDiskInitializeParams(Message):
+    pass
+
+
+class NetworkInterface(Message):
+    pass
+
+
+class Instance(Message):
+    pass
+
+
+class Tags(Message):
+    pass
+
+
+class Firewall(Message):
+    pass
+
+
+class Allowed(Message):
+    pass
+
+
+class Denied(Message):
+    pass
+
+
+class AggregatedListInstancesRequest(Message):
+    pass
+
+
+class Image(Message):
+    pass
+
+
+class InsertImageRequest(Message):
+    pass
+
+
+class Metadata(Message):
+    pass
+
+
+class Items(Message):
+    pass
+
+
+# ---------- resourcemanager_v3 ----------
+
+
+class Project(Message):
+    State = _Enum("ACTIVE", "DELETE_REQUESTED")
+
+
+class SearchProjectsRequest(Message):
+    pass
+
+
+class ProjectsClient:
+    def search_projects(self, request):
+        cloud = _cloud()
+        cloud.api_call("projects.search")
+        return [
+            Project(project_id=p, display_name=p, state=Project.State.ACTIVE)
+            for p in cloud.projects
+        ]
+
+
+def _build_module(name, members):
+    module = types.ModuleType(name)
+    for member in members:
+        setattr(module, member.__name__, member)
+    return module
+
+
+def install():
+    compute_v1 = _build_module(
+        "google.cloud.compute_v1",
+        [
+            InstancesClient,
+            ZoneOperationsClient,
+            GlobalOperationsClient,
+            ZonesClient,
+            ImagesClient,
+            FirewallsClient,
+            DisksClient,
+            AccessConfig,
+            AttachedDisk,
+            AttachedDiskInitializeParams,
+            NetworkInterface,
+            Instance,
+            Tags,
+            Firewall,
+            Allowed,
+            Denied,
+            AggregatedListInstancesRequest,
+            Metadata,
+            Items,
+            Image,
+            InsertImageRequest,
+        ],
+    )
+    resourcemanager_v3 = _build_module(
+        "google.cloud.resourcemanager_v3",
+        [ProjectsClient, Project, SearchProjectsRequest],
+    )
+    google = types.ModuleType("google")
+    cloud = types.ModuleType("google.cloud")
+    google.cloud = cloud
+    cloud.compute_v1 = compute_v1
+    cloud.resourcemanager_v3 = resourcemanager_v3
+    sys.modules.update(
+        {
+            "google": google,
+            "google.cloud": cloud,
+            "google.cloud.compute_v1": compute_v1,
+            "google.cloud.resourcemanager_v3": resourcemanager_v3,
+        }
+    )
+
+
+def use_cloud(cloud, gcp_module=None):
+    global CLOUD
+    CLOUD = cloud
+    if gcp_module is not None:
+        gcp_module.time = cloud.clock.time_module()
+    return cloud
@@ -1,33 +1,149 @@
 #!/bin/bash
 
+# 用法: apt.sh [--probe-only]
+#   --probe-only  只测速并输出选中的镜像，不修改系统
+#
+# 以下环境变量可覆盖默认值（便于用本地 HTTP 服务测试）：
+#   APT_MIRRORS           主仓库候选镜像，空格分隔
+#   APT_SECURITY_MIRRORS  安全更新候选镜像，空格分隔
+#   APT_CODENAME          发行版代号，默认读取 /etc/os-release
+#   APT_SOURCE_FILE       写入的源文件
+#   APT_LISTS_DIR         apt 索引目录
+#   APT_PROBE_TIMEOUT     单个镜像测速超时秒数
+#   APT_KEEP_RATIO        当前镜像得分不超过最快镜像的多少倍时继续沿用，默认 1.5
+#   APT_SKIP_UPDATE=1     写入源文件后不执行 apt update
+
+PROBE_ONLY=0
+if [ "$1" = "--probe-only" ]; then
+    PROBE_ONLY=1
+fi
+
 # 检查 root 权限
-if [ "$EUID" -ne 0 ]; then 
+if [ "$PROBE_ONLY" -eq 0 ] && [ "$EUID" -ne 0 ]; then
     echo "错误: 请以 root 用户运行此脚本"
     exit 1
 fi
 
-SOURCE_FILE="/etc/apt/sources.list.d/debian.sources"
+SOURCE_FILE="${APT_SOURCE_FILE:-/etc/apt/sources.list.d/debian.sources}"
+LISTS_DIR="${APT_LISTS_DIR:-/var/lib/apt/lists}"
+PROBE_TIMEOUT="${APT_PROBE_TIMEOUT:-5}"
+KEEP_RATIO="${APT_KEEP_RATIO:-1.5}"
+MIRRORS="${APT_MIRRORS:-http://deb.debian.org/debian http://mirrors.mit.edu/debian http://mirrors.ocf.berkeley.edu/debian http://debian.osuosl.org/debian http://mirrors.edge.kernel.org/debian}"
+SECURITY_MIRRORS="${APT_SECURITY_MIRRORS:-http://deb.debian.org/debian-security http://security.debian.org/debian-security http://mirrors.ocf.berkeley.edu/debian-security}"
+
+CODENAME="$APT_CODENAME"
+if [ -z "$CODENAME" ] && [ -f /etc/os-release ]; then
+    CODENAME=$(. /etc/os-release && echo "$VERSION_CODENAME")
+fi
+CODENAME="${CODENAME:-bookworm}"
+
+# 测速：并发请求每个镜像的 InRelease（几十 KB 的小文件），
+# 记录首字节时间 (TTFB) 和下载速度，按 "TTFB + 下载 1MB 索引的预估时间" 打分。
+# 当前镜像的得分与最快镜像相差不超过 APT_KEEP_RATIO 倍时继续沿用，避免来回切换导致索引重新下载
+probe_mirrors() {
+    suite="$1"
+    current="$2"
+    shift 2
+    result_dir=$(mktemp -d /tmp/apt_probe.XXXXXX)
+    i=0
+    for mirror in "$@"; do
+        i=$((i + 1))
+        (
+            out=$(curl -o /dev/null -s --max-time "$PROBE_TIMEOUT" \
+                -w '%{http_code} %{time_starttransfer} %{speed_download}' \
+                "$mirror/dists/$suite/InRelease")
+            echo "$out $mirror" > "$result_dir/$i"
+        ) &
+    done
+    wait
 
-echo "=== 正在换源 ==="
+    cat "$result_dir"/* 2>/dev/null | awk '
+        $1 == 200 && $3 > 0 {
+            score = $2 + 1048576 / $3
+            printf "%.4f %s %.3f %.0f\n", score, $4, $2, $3 / 1024
+        }' | sort -n > "$result_dir/ranked"
 
+    while read -r score mirror ttfb kbps; do
+        echo "   $mirror  TTFB ${ttfb}s  ${kbps} KB/s" >&2
+    done < "$result_dir/ranked"
 
-cat > "$SOURCE_FILE" <<EOF
+    awk -v current="$current" -v ratio="$KEEP_RATIO" '
+        NR == 1 { best = $1; pick = $2 }
+        $2 == current && $1 <= best * ratio { pick = $2 }
+        END { if (pick != "") print pick }
+    ' "$result_dir/ranked"
+    rm -rf "$result_dir"
+}
+
+# 从现有源文件中读取当前使用的镜像，测速全部失败时沿用
+current_mirror() {
+    suite="$1"
+    [ -f "$SOURCE_FILE" ] || return
+    awk -v suite="$suite" '
+        /^URIs:/ { uri = $2 }
+        /^Suites:/ { for (i = 2; i <= NF; i++) if ($i == suite) { print uri; exit } }
+    ' "$SOURCE_FILE"
+}
+
+echo "=== 正在测速镜像 ($CODENAME) ==="
+echo "-> 主仓库:"
+# shellcheck disable=SC2086
+MAIN_MIRROR=$(probe_mirrors "$CODENAME-updates" "$(current_mirror "$CODENAME")" $MIRRORS)
+echo "-> 安全更新:"
+# shellcheck disable=SC2086
+SECURITY_MIRROR=$(probe_mirrors "$CODENAME-security" "$(current_mirror "$CODENAME-security")" $SECURITY_MIRRORS)
+
+if [ -z "$MAIN_MIRROR" ]; then
+    MAIN_MIRROR=$(current_mirror "$CODENAME")
+    echo "警告: 主仓库镜像测速全部失败，沿用: ${MAIN_MIRROR:-无}"
+fi
+if [ -z "$SECURITY_MIRROR" ]; then
+    SECURITY_MIRROR=$(current_mirror "$CODENAME-security")
+    echo "警告: 安全更新镜像测速全部失败，沿用: ${SECURITY_MIRROR:-无}"
+fi
+if [ -z "$MAIN_MIRROR" ] || [ -z "$SECURITY_MIRROR" ]; then
+    echo "=== 没有可用的镜像，请检查网络或通过 APT_MIRRORS 指定镜像 ==="
+    exit 1
+fi
+
+echo "=== 选择的镜像 ==="
+echo "$CODENAME $CODENAME-updates $CODENAME-backports: $MAIN_MIRROR"
+echo "$CODENAME-security: $SECURITY_MIRROR"
+
+if [ "$PROBE_ONLY" -eq 1 ]; then
+    exit 0
+fi
+
+NEW_SOURCES=$(cat <<EOF
 Types: deb deb-src
-URIs: http://mirrors.mit.edu/debian
-Suites: bookworm bookworm-updates bookworm-backports
+URIs: $MAIN_MIRROR
+Suites: $CODENAME $CODENAME-updates $CODENAME-backports
 Components: main
 Signed-By: /usr/share/keyrings/debian-archive-keyring.gpg
 
 Types: deb deb-src
-URIs: http://mirrors.ocf.berkeley.edu/debian-security
-Suites: bookworm-security
+URIs: $SECURITY_MIRROR
+Suites: $CODENAME-security
 Components: main
 Signed-By: /usr/share/keyrings/debian-archive-keyring.gpg
 EOF
+)
 
-# 3. 清理并更新
-echo "-> 清理缓存..."
-rm -rf /var/lib/apt/lists/*
+if [ -f "$SOURCE_FILE" ] && [ "$(cat "$SOURCE_FILE")" = "$NEW_SOURCES" ]; then
+    # 镜像没变，保留现有索引，apt update 只会增量拉取有变化的部分
+    echo "-> 镜像未变化，保留现有索引。"
+else
+    echo "=== 正在换源 ==="
+    mkdir -p "$(dirname "$SOURCE_FILE")"
+    echo "$NEW_SOURCES" > "$SOURCE_FILE"
+
+    echo "-> 清理缓存..."
+    rm -rf "${LISTS_DIR:?}"/*
+fi
+
+if [ "$APT_SKIP_UPDATE" = "1" ]; then
+    exit 0
+fi
 
 echo "-> 正在更新源..."
 apt update
@@ -36,4 +152,4 @@ if [ $? -eq 0 ]; then
     echo "=== 完美！所有源均已连接成功"
 else
     echo "=== 仍然有错误，请检查网络或尝试其他镜像 ==="
-fi
\ No newline at end of file
+fi
@@ -163,10 +163,103 @@ notice_installled_tool() {
     fi
 }
 
+## Download cache
+# $CACHE_DIR/sha256/<sha256>  有校验值的文件，按内容寻址，校验值不变就不再下载
+# $CACHE_DIR/url/<key>        按版本号固定的 URL（service、completion、示例配置）
+# $CACHE_DIR/partial/         未下载完的文件，下次运行时断点续传
+CACHE_DIR="${DAE_CACHE_DIR:-/var/cache/dae-installer}"
+
+prepare_cache() {
+    mkdir -p "$CACHE_DIR"/sha256 "$CACHE_DIR"/url "$CACHE_DIR"/partial
+    # 清理 30 天未使用的缓存
+    find "$CACHE_DIR"/sha256 "$CACHE_DIR"/url "$CACHE_DIR"/partial -type f -mtime +30 -exec rm -f {} + 2>/dev/null || true
+}
+
+url_key() {
+    printf '%s' "$1" | cksum | awk '{print $1"-"$2}'
+}
+
+# fetch_verified <url> <sha256> <dest>
+fetch_verified() {
+    fetch_url="$1"
+    fetch_sha256="$2"
+    fetch_dest="$3"
+    fetch_cached="$CACHE_DIR/sha256/$fetch_sha256"
+    fetch_partial="$CACHE_DIR/partial/$fetch_sha256"
+    if [ -f "$fetch_cached" ] && [ "$(SHA256SUM "$fetch_cached")" = "$fetch_sha256" ]; then
+        echo_green "Using cached $(basename "$fetch_dest")"
+        touch "$fetch_cached"
+        cp "$fetch_cached" "$fetch_dest"
+        return 0
+    fi
+    if [ ! -f "$fetch_partial" ] || [ "$(SHA256SUM "$fetch_partial")" != "$fetch_sha256" ]; then
+        if [ -s "$fetch_partial" ]; then
+            echo_green "Resuming $(basename "$fetch_dest")..."
+        fi
+        fetch_rc=0
+        curl -fsSL --retry 3 -C - "$fetch_url" -o "$fetch_partial" || fetch_rc=$?
+        if [ "$fetch_rc" -eq 33 ] || [ "$fetch_rc" -eq 36 ]; then
+            # 服务器不支持断点续传，丢弃已下载部分
+            rm -f "$fetch_partial"
+        elif [ "$fetch_rc" -ne 0 ]; then
+            # 保留已下载的部分，下次运行时续传
+            return 1
+        fi
+        if [ ! -f "$fetch_partial" ] || [ "$(SHA256SUM "$fetch_partial")" != "$fetch_sha256" ]; then
+            # 续传结果不对（例如远端文件已更新），完整重新下载一次
+            rm -f "$fetch_partial"
+            if ! curl -fsSL --retry 3 "$fetch_url" -o "$fetch_partial"; then
+                return 1
+            fi
+        fi
+    fi
+    fetch_local_sha256=$(SHA256SUM "$fetch_partial")
+    if [ "$fetch_local_sha256" != "$fetch_sha256" ]; then
+        echo_red "error: The checksum of the downloaded $(basename "$fetch_dest") does not match!"
+        echo_red "Local SHA256: $fetch_local_sha256"
+        echo_red "Remote SHA256: $fetch_sha256"
+        rm -f "$fetch_partial"
+        return 2
+    fi
+    mv "$fetch_partial" "$fetch_cached"
+    cp "$fetch_cached" "$fetch_dest"
+}
+
+# fetch_url_cached <url> <dest>，只用于内容随版本号固定的 URL
+fetch_url_cached() {
+    fetch_key=$(url_key "$1")
+    fetch_cached="$CACHE_DIR/url/$fetch_key"
+    fetch_partial="$CACHE_DIR/partial/url-$fetch_key"
+    if [ -f "$fetch_cached" ]; then
+        echo_green "Using cached $(basename "$2")"
+        touch "$fetch_cached"
+    else
+        if ! curl -fsSL --retry 3 -C - "$1" -o "$fetch_partial"; then
+            rm -f "$fetch_partial"
+            return 1
+        fi
+        mv "$fetch_partial" "$fetch_cached"
+    fi
+    cp "$fetch_cached" "$2"
+}
+
+# run_parallel <function>...，任一失败则返回非 0
+run_parallel() {
+    parallel_pids=""
+    for parallel_job in "$@"; do
+        "$parallel_job" &
+        parallel_pids="$parallel_pids $!"
+    done
+    parallel_failed=0
+    for parallel_pid in $parallel_pids; do
+        wait "$parallel_pid" || parallel_failed=1
+    done
+    return $parallel_failed
+}
+
 download_systemd_service() {
-    systemd_service_temp_dir=$(mktemp -d /tmp/dae.XXXXXX)
     echo_green "Download systemd service..."
-    if ! curl -L -# "$systemd_service_url" -o "$systemd_service_temp_dir"/dae.service; then
+    if ! fetch_url_cached "$systemd_service_url" "$download_dir"/dae.service; then
         echo_red "error: Failed to download Systemd Service!"
         echo_red "Please check your network and try again."
         exit 1
@@ -175,16 +268,15 @@ download_systemd_service() {
 
 install_systemd_service() {
     echo_green "Installing/updating systemd service..."
-    sed 's|usr/bin|usr/local/bin|g' < "$systemd_service_temp_dir"/dae.service | sed 's|etc|usr/local/etc|g' | tee /etc/systemd/system/dae.service
+    sed 's|usr/bin|usr/local/bin|g' < "$download_dir"/dae.service | sed 's|etc|usr/local/etc|g' | tee /etc/systemd/system/dae.service
     systemctl daemon-reload
     echo_green "Systemd service installed/updated."
-    rm -rf "$systemd_service_temp_dir"
 }
 
 download_openrc_service() {
-    openrc_service_temp_dir=$(mktemp -d /tmp/dae.XXXXXX)
     echo_green "Download OpenRC service..."
-    if ! curl -L -# $openrc_service_url -o "$openrc_service_temp_dir"/dae-openrc.sh; then
+    # OpenRC 脚本的 URL 不带版本号，不走缓存
+    if ! curl -fsSL --retry 3 "$openrc_service_url" -o "$download_dir"/dae-openrc.sh; then
         echo_red "error: Failed to download OpenRC Service!"
         echo_red "Please check your network and try again."
         exit 1
@@ -193,10 +285,9 @@ download_openrc_service() {
 
 install_openrc_service() {
     echo_green "Installing/updating OpenRC service..."
-    tee /etc/init.d/dae < "$openrc_service_temp_dir"/dae-openrc.sh
+    tee /etc/init.d/dae < "$download_dir"/dae-openrc.sh
     chmod +x /etc/init.d/dae
     echo_green "OpenRC service installed/updated"
-    rm -rf "$openrc_service_temp_dir"
 }
 
 download_service() {
@@ -350,69 +441,45 @@ check_share_dir() {
 }
 
 download_geoip() {
-    geoip_temp_dir=$(mktemp -d /tmp/dae.XXXXXX)
     echo_green "Downloading GeoIP database..."
     echo_green "Downloading from: $geoip_url"
-    if ! curl -L "$geoip_url" -o "$geoip_temp_dir"/geoip.dat --progress-bar; then
-        echo_red "error: Failed to download GeoIP database!"
-        echo_red "Please check your network and try again."
-        exit 1
-    fi
-    if ! curl -sL "$geoip_url".sha256sum -o "$geoip_temp_dir"/geoip.dat.sha256sum; then
+    if ! curl -fsSL --retry 3 "$geoip_url".sha256sum -o "$download_dir"/geoip.dat.sha256sum; then
         echo_red "error: Failed to download the checksum file of GeoIP database!"
         echo_red "Please check your network and try again."
-        rm -f geoip.dat
         exit 1
     fi
-    geoip_local_sha256=$(SHA256SUM "$geoip_temp_dir"/geoip.dat)
-    geoip_remote_sha256=$(awk -F ' ' '{print $1}' < "$geoip_temp_dir"/geoip.dat.sha256sum)
-    if [ "$geoip_local_sha256" != "$geoip_remote_sha256" ]; then
-        echo_red "error: The checksum of the downloaded GeoIP database does not match!"
-        echo_red "Local SHA256: $geoip_local_sha256"
-        echo_red "Remote SHA256: $geoip_remote_sha256"
+    geoip_remote_sha256=$(awk -F ' ' '{print $1}' < "$download_dir"/geoip.dat.sha256sum)
+    if ! fetch_verified "$geoip_url" "$geoip_remote_sha256" "$download_dir"/geoip.dat; then
+        echo_red "error: Failed to download GeoIP database!"
         echo_red "Please check your network and try again."
-        rm -rf "$geoip_temp_dir"
         exit 1
     fi
 }
 update_geoip() {
     check_share_dir
-    cp "$geoip_temp_dir"/geoip.dat /usr/local/share/dae/
-    rm -rf "$geoip_temp_dir"
+    cp "$download_dir"/geoip.dat /usr/local/share/dae/
     echo_green "GeoIP database have been installed/updated."
 }
 
 download_geosite() {
-    geosite_temp_dir=$(mktemp -d /tmp/dae.XXXXXX)
     echo_green "Downloading GeoSite database..."
     echo_green "Downloading from: $geosite_url"
-    if ! curl -L "$geosite_url" -o "$geosite_temp_dir"/geosite.dat --progress-bar; then
-        echo_red "error: Failed to download GeoSite database!"
-        echo_red "Please check your network and try again."
-        exit 1
-    fi
-    if ! curl -sL "$geosite_url".sha256sum -o "$geosite_temp_dir"/geosite.dat.sha256sum; then
+    if ! curl -fsSL --retry 3 "$geosite_url".sha256sum -o "$download_dir"/geosite.dat.sha256sum; then
         echo_red "error: Failed to download the checksum file of GeoSite database!"
         echo_red "Please check your network and try again."
-        rm -rf "$geosite_temp_dir"
         exit 1
     fi
-    geosite_local_sha256=$(SHA256SUM "$geosite_temp_dir"/geosite.dat)
-    geosite_remote_sha256=$(awk -F ' ' '{print $1}' < "$geosite_temp_dir"/geosite.dat.sha256sum)
-    if [ "$geosite_local_sha256" != "$geosite_remote_sha256" ]; then
-        echo_red "error: The checksum of the downloaded GeoSite database does not match!"
-        echo_red "Local SHA256: $geosite_local_sha256"
-        echo_red "Remote SHA256: $geosite_remote_sha256"
+    geosite_remote_sha256=$(awk -F ' ' '{print $1}' < "$download_dir"/geosite.dat.sha256sum)
+    if ! fetch_verified "$geosite_url" "$geosite_remote_sha256" "$download_dir"/geosite.dat; then
+        echo_red "error: Failed to download GeoSite database!"
         echo_red "Please check your network and try again."
-        rm -rf "$geosite_temp_dir"
         exit 1
     fi
 }
 
 update_geosite() {
     check_share_dir
-    cp "$geosite_temp_dir"/geosite.dat /usr/local/share/dae/
-    rm -rf "$geosite_temp_dir"
+    cp "$download_dir"/geosite.dat /usr/local/share/dae/
     echo_green "GeoSite database have been installed/updated."
 }
 
@@ -455,43 +522,30 @@ start_dae() {
 download_dae() {
     echo_green "Downloading dae..."
     echo_green "Downloading from: $dae_url"
-    if ! curl -LO "$dae_url" --progress-bar; then
-        echo_red "error: Failed to download dae!"
+    if ! curl -fsSL --retry 3 "$dae_hash_url" -o "$download_dir"/dae-linux-"$MACHINE".zip.dgst; then
+        echo_red "error: Failed to download the checksum file!"
         echo_red "Please check your network and try again."
         exit 1
     fi
-    local_sha256=$(SHA256SUM dae-linux-"$MACHINE".zip | awk -F ' ' '{print $1}')
-    if [ -z "$local_sha256" ]; then
-        echo_red "error: Failed to get the checksum of the downloaded file!"
+    remote_sha256=$(cat "$download_dir"/dae-linux-"$MACHINE".zip.dgst | awk -F "./dae-linux-$MACHINE.zip" 'NR==3' | awk '{print $1}')
+    if [ -z "$remote_sha256" ]; then
+        echo_red "error: Failed to get the checksum of dae!"
         echo_red "Please check your network and try again."
-        rm -f dae-linux-"$MACHINE".zip
         exit 1
     fi
-    if ! curl -sL "$dae_hash_url" -o dae-linux-"$MACHINE".zip.dgst; then
-        echo_red "error: Failed to download the checksum file!"
-        echo_red "Please check your network and try again."
-        rm -f dae-linux-"$MACHINE".zip.dgst
-        exit 1
-    fi
-    remote_sha256=$(cat ./dae-linux-"$MACHINE".zip.dgst | awk -F "./dae-linux-$MACHINE.zip" 'NR==3' | awk '{print $1}')
-    if [ "$local_sha256" != "$remote_sha256" ]; then
-        echo_red "error: The checksum of the downloaded file does not match!"
-        echo_red "Local SHA256: $local_sha256"
-        echo_red "Remote SHA256: $remote_sha256"
+    if ! fetch_verified "$dae_url" "$remote_sha256" "$download_dir"/dae-linux-"$MACHINE".zip; then
+        echo_red "error: Failed to download dae!"
         echo_red "Please check your network and try again."
-        rm -f dae-linux-"$MACHINE".zip
         exit 1
     fi
-    rm -f dae-linux-"$MACHINE".zip.dgst
 }
 
 install_dae() {
     temp_dir="$(mktemp -d /tmp/dae.XXXXXX)"
     echo_green "unzipping dae's zip file..."
-    unzip dae-linux-"$MACHINE".zip -d "$temp_dir" >>/dev/null
+    unzip "$download_dir"/dae-linux-"$MACHINE".zip -d "$temp_dir" >>/dev/null
     cp "$temp_dir""/dae-linux-""$MACHINE" /usr/local/bin/dae
     chmod +x /usr/local/bin/dae
-    rm -f dae-linux-"$MACHINE".zip
     echo_green "dae have been installed/updated."
     rm -rf "$temp_dir"
 }
@@ -502,8 +556,9 @@ download_example_config() {
     if [ ! -d /usr/local/etc/dae ]; then
         mkdir -p /usr/local/etc/dae
     fi
-    if ! curl -L "$example_config_url" -o /usr/local/etc/dae/example.dae --progress-bar; then
-        notify_example="yes"
+    if ! fetch_url_cached "$example_config_url" /usr/local/etc/dae/example.dae; then
+        # 在后台子进程中运行，用文件把结果传回主进程
+        touch "$download_dir"/notify_example
     fi
 }
 
@@ -511,7 +566,7 @@ download_bash_completion() {
     [ -d /usr/share/bash-completion/completions ] || mkdir -p /usr/share/bash-completion/completions
     echo_green "Downloading bash completion file..."
     echo_green "Downloading from: $bash_completion_url"
-    if ! curl -L "$bash_completion_url" -o /usr/share/bash-completion/completions/dae --progress-bar; then
+    if ! fetch_url_cached "$bash_completion_url" /usr/share/bash-completion/completions/dae; then
         echo_yellow "Failed to download bash completion file."
     fi
 }
@@ -520,7 +575,7 @@ download_zsh_completion() {
     [ -d /usr/share/zsh/site-functions ] || mkdir -p /usr/share/zsh/site-functions
     echo_green "Downloading zsh completion file..."
     echo_green "Downloading from: $zsh_completion_url"
-    if ! curl -L "$zsh_completion_url" -o /usr/share/zsh/site-functions/_dae --progress-bar; then
+    if ! fetch_url_cached "$zsh_completion_url" /usr/share/zsh/site-functions/_dae; then
         echo_yellow "Failed to download zsh completion file."
     fi
 }
@@ -529,26 +584,27 @@ download_fish_completion() {
     [ -d /usr/share/fish/vendor_completions.d ] || mkdir -p /usr/share/fish/vendor_completions.d
     echo_green "Downloading fish completion file..."
     echo_green "Downloading from: $fish_completion_url"
-    if ! curl -L "$fish_completion_url" -o /usr/share/fish/vendor_completions.d/dae.fish --progress-bar; then
+    if ! fetch_url_cached "$fish_completion_url" /usr/share/fish/vendor_completions.d/dae.fish; then
         echo_yellow "Failed to download fish completion file."
     fi
 }
 
 download_completions() {
     if command -v bash >/dev/null 2>&1; then
-        download_bash_completion
+        download_bash_completion &
     fi
     if command -v zsh >/dev/null 2>&1; then
-        download_zsh_completion
+        download_zsh_completion &
     fi
     if command -v fish >/dev/null 2>&1; then
-        download_fish_completion
+        download_fish_completion &
     fi
+    wait
 }
 
 notify_configuration() {
     echo '----------------------------------------------------------------------'
-    if [ "$notify_example" = 'yes' ]; then
+    if [ -f "$download_dir"/notify_example ]; then
         echo '----------------------------------------------------------------------'
         echo_yellow "warning: Failed to download example config file."
         echo_yellow "You can download it from:
@@ -586,12 +642,12 @@ notify_configuration() {
 
 installation() {
     echo_dae
-    download_dae
-    download_geoip
-    download_geosite
-    download_example_config
-    download_service
-    download_completions
+    prepare_cache
+    # 各文件互不依赖，并发下载；任一必需文件失败则中止安装
+    if ! run_parallel download_dae download_geoip download_geosite download_example_config download_service download_completions; then
+        echo_red "error: Failed to download some files, installation aborted."
+        exit 1
+    fi
     stop_dae
     install_dae
     update_geoip
@@ -650,6 +706,8 @@ cd /tmp/ || (
     echo_yellow "Failed to cd /tmp/"
     exit 1
 )
+download_dir=$(mktemp -d /tmp/dae.XXXXXX)
+trap 'rm -rf "$download_dir"; cd "$current_dir"' 0 1 2 3
 if [ "$1" = "" ] || [ "$1" = "use-cdn" ]; then
     if [ "$1" = "use-cdn" ]; then
         use_cdn='yes'
@@ -706,13 +764,13 @@ if [ "$force_install" = 'yes' ] || [ "$normal_install" = 'yes' ] || [ "$allow_pr
 fi
 if [ "$geoip_should_update" = 'yes' ]; then
     get_download_urls
+    prepare_cache
     download_geoip
     update_geoip
 fi
 if [ "$geosite_should_update" = 'yes' ]; then
     get_download_urls
+    prepare_cache
     download_geosite
     update_geosite
-fi
-
-trap 'cd "$current_dir"' 0 1 2 3
\ No newline at end of file
+fi
\ No newline at end of file